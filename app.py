@@ -80,16 +80,33 @@ import zipfile
 import yaml
 import urllib.parse
 import re
-import base64
 import pdfplumber
 import unicodedata
 import requests
+import hashlib
+import json
+import shutil
+import uuid
+import time
+import threading
+from collections import OrderedDict
 from io import BytesIO
 from PIL import Image
 from datetime import datetime
 from jinja2 import Environment, FileSystemLoader
-from weasyprint import HTML
 from pypdf import PdfWriter, PdfReader
+from photo_extract import (
+    clean_ligatures, debug_dump_pua_chars, extract_pages, default_extract_workers,
+    build_surname_trie, page_roster_fingerprint, orphan_thumbnails, save_orphan_crop,
+)
+from name_matching import (
+    NAME_TOKEN_RE, whole_word, build_roster_name_index, match_names_to_roster,
+    build_fuzzy_name_index, suggest_roster_matches,
+)
+from booklet_render import (
+    render_parts, default_render_workers, append_booklet, compose_booklet, write_booklet,
+    split_student_pages,
+)
 
 # ---------------- CONFIG ----------------
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -97,6 +114,61 @@ TEMPLATE_DIR = os.path.join(BASE_DIR, "templates")
 TEMP_DIR = os.path.join(BASE_DIR, "_temp")
 os.makedirs(TEMP_DIR, exist_ok=True)
 
+# Attachment compression settings:
+# 150 DPI and JPEG quality 72 give a good size/quality balance for
+# action plan documents. Max dimension cap prevents oversized scans
+# from inflating the PDF further.
+ATTACH_DPI     = 150
+ATTACH_QUALITY = 72
+ATTACH_MAX_PX  = 2000  # longest edge cap in pixels
+
+# Converted attachment pages are cached by content hash + the settings above:
+# a bounded in-memory tier shared by every session of this server, backed by
+# a bounded on-disk tier that survives restarts.
+ATTACH_CACHE_DIR       = os.path.join(TEMP_DIR, "attach_cache")
+ATTACH_CACHE_MEM_ITEMS = 256
+ATTACH_CACHE_DISK_MB   = 256
+
+# Generated ZIPs / PDFs are written here as they are produced and the download
+# is served from the file, so a whole job is never held in memory at once
+OUTPUT_DIR = os.path.join(TEMP_DIR, "outputs")
+# Outputs older than this are swept on the next write — a session removes its
+# own previous file, but one that was closed mid-way never comes back for it
+OUTPUT_TTL_HOURS = 24
+
+# Photo-PDF scans are cached on disk per PDF (SHA-256 of the file): claimed
+# crops, orphan crops and match diagnostics for each page, plus the roster
+# fingerprint each page was matched against. Every session and roster that
+# scans the PDF shares the directory, so crops are named by page image (not
+# student) and are only ever removed by _prune_photo_cache. Bump the version
+# whenever the matcher in photo_extract.py changes what it would produce.
+PHOTO_CACHE_DIR      = os.path.join(TEMP_DIR, "photo_cache")
+PHOTO_CACHE_MAX_PDFS = 8
+# A PDF's directory counts as in use (and is never pruned) for this long after
+# a session last scanned it, showed its orphans or read one of its crops
+PHOTO_CACHE_IN_USE_HOURS = 12
+PHOTO_CACHE_VERSION  = 4
+
+# Student photos are only ever shown at these sizes (CSS px, see profiles.css
+# and the grid_* sizes in profiles.html: a quarter of the 180 mm A4 content
+# width by --grid-img-h, and .profile-photo). Each matched crop is downscaled
+# once per session to cover every box at PHOTO_RENDITION_SCALE× and kept in
+# memory. One rendition serves all of them: WeasyPrint embeds JPEG bytes
+# unchanged, so the photo grid and the profile page then carry identical
+# image streams that write_booklet() merges into one.
+PHOTO_RENDITION_BOXES   = [(170, 160), (90, 112)]
+PHOTO_RENDITION_SCALE   = 2
+PHOTO_RENDITION_QUALITY = 85
+
+# Photos needing review are listed this many at a time; thumbnails are only
+# made for the slice on screen
+ORPHAN_REVIEW_PAGE_SIZE = 24
+
+# Rendered profile pages kept per session, keyed by profile_cache_key(), so a
+# regenerate only lays out students whose inputs changed. Bounded by the
+# total size of the cached per-student PDFs.
+PROFILE_CACHE_MAX_MB = 200
+
 st.set_page_config(
     page_title="Medical Booklet Tools",
     layout="wide",
@@ -118,6 +190,11 @@ except FileNotFoundError:
 COLS = CONFIG["column_mappings"]
 SEVERITY_KEYWORDS = CONFIG["severity_keywords"]
 
+# Fuzzy suggestions for records the exact matchers missed (see
+# name_matching.suggest_roster_matches): the best one is pre-selected in the
+# review dropdowns when its trigram similarity reaches this (0–1).
+FUZZY_AUTO_ACCEPT = float(CONFIG.get("app_settings", {}).get("fuzzy_auto_accept", 0.85))
+
 # Roll group code → full display name. Unknown codes fall back to the raw value.
 ROLLGROUP_NAMES = {
     "7M": "7 Mott",    "7B": "7 Backhouse", "7F": "7 Fry",
@@ -161,9 +238,49 @@ GLOSSARY = {
 }
 
 # ---------------- HELPERS ----------------
-def img_to_base64(path):
-    if not path or not os.path.exists(path): return None
-    with open(path, "rb") as f: return base64.b64encode(f.read()).decode()
+def _make_photo_rendition(data):
+    """Returns the JPEG bytes of one photo crop sized for the template."""
+    img = Image.open(BytesIO(data))
+    # Smallest size that still covers every box (the template uses
+    # object-fit: cover), so nothing is upscaled or cropped here
+    scale = max(
+        max(box_w * PHOTO_RENDITION_SCALE / img.width, box_h * PHOTO_RENDITION_SCALE / img.height)
+        for box_w, box_h in PHOTO_RENDITION_BOXES
+    )
+    if scale >= 1:
+        return data  # already small enough — keep the original bytes
+    size = (max(1, round(img.width * scale)), max(1, round(img.height * scale)))
+    img.draft("RGB", size)  # JPEG crops decode at a reduced scale
+    out = img.convert("RGB").resize(size, Image.LANCZOS)
+    buf = BytesIO()
+    out.save(buf, format="JPEG", quality=PHOTO_RENDITION_QUALITY, optimize=True)
+    return buf.getvalue()
+
+def photo_rendition(path):
+    """
+    Template-sized rendition of a matched photo crop, read from disk once per
+    session. Entries are keyed by the file's mtime and size as well as its
+    path, so a crop rewritten in place (a rescan, an orphan cut again) is
+    read afresh. Returns None when there is no crop.
+    """
+    if not path:
+        return None
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    store = st.session_state.setdefault("photo_store", {})
+    key = (path, stat.st_mtime_ns, stat.st_size)
+    if key in store:
+        return store[key]
+    try:
+        with open(path, "rb") as f:
+            store[key] = _make_photo_rendition(f.read())
+        _touch_photo_cache(os.path.dirname(path))
+    except Exception as e:
+        print(f"[Photos] Could not prepare {os.path.basename(path)}: {e}")
+        return None
+    return store[key]
 
 def parse_tutor(text):
     """Extracts Tutor name from General Notes."""
@@ -174,22 +291,113 @@ def parse_tutor(text):
         return match.group(1).strip()
     return ""
 
+@st.cache_resource
+def _attach_memory_cache():
+    """
+    Process-wide LRU of attachment cache key → list of JPEG page bytes, and
+    the lock that guards it — every session's script thread shares the dict.
+    """
+    return OrderedDict(), threading.Lock()
+
+def _attach_cache_key(file_bytes):
+    h = hashlib.sha256(file_bytes)
+    h.update(f"|dpi={ATTACH_DPI}|q={ATTACH_QUALITY}|max={ATTACH_MAX_PX}".encode())
+    return h.hexdigest()
+
+def _attach_cache_get(key):
+    mem, lock = _attach_memory_cache()
+    with lock:
+        if key in mem:
+            mem.move_to_end(key)
+            return mem[key]
+    entry_dir = os.path.join(ATTACH_CACHE_DIR, key)
+    if not os.path.isdir(entry_dir):
+        return None
+    try:
+        pages = []
+        for page_file in sorted(os.listdir(entry_dir)):
+            with open(os.path.join(entry_dir, page_file), "rb") as f:
+                pages.append(f.read())
+        os.utime(entry_dir)  # mark as recently used for disk pruning
+    except OSError:
+        return None
+    _attach_memory_put(key, pages)
+    return pages
+
+def _attach_memory_put(key, pages):
+    mem, lock = _attach_memory_cache()
+    with lock:
+        mem[key] = pages
+        mem.move_to_end(key)
+        while len(mem) > ATTACH_CACHE_MEM_ITEMS:
+            mem.popitem(last=False)
+
+def _attach_cache_put(key, pages):
+    _attach_memory_put(key, pages)
+    # Write into a scratch dir and rename, so a half-written entry is never read
+    tmp_dir = os.path.join(ATTACH_CACHE_DIR, f".tmp-{key}-{os.getpid()}")
+    try:
+        os.makedirs(tmp_dir, exist_ok=True)
+        for n, page in enumerate(pages):
+            with open(os.path.join(tmp_dir, f"{n:04d}.jpg"), "wb") as f:
+                f.write(page)
+        os.replace(tmp_dir, os.path.join(ATTACH_CACHE_DIR, key))
+        _prune_attach_disk_cache()
+    except OSError as e:
+        print(f"[AttachCache] Could not write {key[:12]}: {e}")
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+def _prune_attach_disk_cache():
+    """Drops least-recently-used entries until the disk tier fits its budget."""
+    entries, total = [], 0
+    for name in os.listdir(ATTACH_CACHE_DIR):
+        entry_dir = os.path.join(ATTACH_CACHE_DIR, name)
+        if name.startswith(".tmp-") or not os.path.isdir(entry_dir):
+            continue
+        size = sum(os.path.getsize(os.path.join(entry_dir, f)) for f in os.listdir(entry_dir))
+        entries.append((os.path.getmtime(entry_dir), size, entry_dir))
+        total += size
+    budget = ATTACH_CACHE_DISK_MB * 1024 * 1024
+    for _, size, entry_dir in sorted(entries):
+        if total <= budget:
+            break
+        shutil.rmtree(entry_dir, ignore_errors=True)
+        total -= size
+
 def convert_file_to_images(file_obj):
     """
-    Converts a file (PDF or Image) into a list of Base64 strings (one per page).
-    Uses magic byte sniffing to detect file type reliably — never relies solely
-    on the .name extension, which may be absent or wrong for BytesIO/UploadedFile.
+    Converts a file (PDF or Image) into a list of JPEG bytes (one per page).
+    Results are cached by the SHA-256 of the file bytes plus the ATTACH_*
+    settings, so a shared ASCIA/asthma plan template is converted once per
+    machine rather than once per student per Generate click.
     """
-    images_b64 = []
     try:
         file_obj.seek(0)
         file_bytes = file_obj.read()
+    except Exception:
+        return []
+    if not file_bytes:
+        return []
+
+    key = _attach_cache_key(file_bytes)
+    cached = _attach_cache_get(key)
+    if cached is not None:
+        return cached
 
-        if not file_bytes:
-            return []
+    images = _rasterise_attachment(file_bytes, getattr(file_obj, 'name', '') or '')
+    if images:
+        _attach_cache_put(key, images)
+    return images
 
+def _rasterise_attachment(file_bytes, fname):
+    """
+    Rasterises attachment bytes to compressed JPEG pages.
+    Uses magic byte sniffing to detect file type reliably — never relies solely
+    on the .name extension, which may be absent or wrong for BytesIO/UploadedFile.
+    """
+    images = []
+    try:
         file_buffer = BytesIO(file_bytes)
-        fname = getattr(file_obj, 'name', '') or ''
 
         # Detect type by magic bytes first, then fall back to extension
         is_pdf = file_bytes[:4] == b'%PDF'
@@ -197,14 +405,6 @@ def convert_file_to_images(file_obj):
         is_jpg = file_bytes[:3] == b'\xff\xd8\xff'
         name_says_pdf = fname.lower().endswith('.pdf')
 
-        # Attachment compression settings:
-        # 150 DPI and JPEG quality 72 give a good size/quality balance for
-        # action plan documents. Max dimension cap prevents oversized scans
-        # from inflating the PDF further.
-        ATTACH_DPI     = 150
-        ATTACH_QUALITY = 72
-        ATTACH_MAX_PX  = 2000  # longest edge cap in pixels
-
         def _compress_img(im):
             """Resize if oversized, then return compressed JPEG bytes."""
             im = im.convert("RGB")
@@ -214,22 +414,94 @@ def convert_file_to_images(file_obj):
                 im = im.resize((int(w * scale), int(h * scale)), Image.Resampling.LANCZOS)
             buf = BytesIO()
             im.save(buf, format="JPEG", quality=ATTACH_QUALITY, optimize=True)
-            return base64.b64encode(buf.getvalue()).decode()
+            return buf.getvalue()
 
         if is_pdf or (name_says_pdf and not is_png and not is_jpg):
             with pdfplumber.open(file_buffer) as pdf:
                 for page in pdf.pages:
                     im = page.to_image(resolution=ATTACH_DPI).original
-                    images_b64.append(_compress_img(im))
+                    images.append(_compress_img(im))
         else:
             img = Image.open(file_buffer)
-            images_b64.append(_compress_img(img))
-
+            images.append(_compress_img(img))
 
     except Exception as e:
-        fname = getattr(file_obj, 'name', 'unknown')
+        print(f"[Attach] Could not convert {fname or 'attachment'}: {e}")
 
-    return images_b64
+    return images
+
+def profile_cache_key(profile_obj, image_registry, pdf_attachments, context):
+    """
+    Hash of everything that feeds one student's profile + attachment pages:
+    the final profile_obj, the bytes behind its img:// URLs and attachment
+    markers (a corrected photo keeps its URL but changes its bytes), and the
+    render context — display options, booklet date and template/CSS source.
+    """
+    h = hashlib.sha256(json.dumps([profile_obj, context], sort_keys=True, default=str).encode())
+    urls = [profile_obj.get("photo")] + [att["src"] for att in profile_obj.get("attachments", [])]
+    for url in urls:
+        if url:
+            h.update(hashlib.sha256(image_registry[url]).digest())
+    markers = list(profile_obj.get("pdf_after_profile", []))
+    for att in profile_obj.get("attachments", []):
+        markers.extend(att["pdf_after"])
+    for marker in markers:
+        h.update(hashlib.sha256(pdf_attachments[marker]).digest())
+    return h.hexdigest()
+
+def new_output_path(file_name):
+    """
+    Returns a fresh per-run path under _temp/outputs for a generated file.
+    This session's previous output is deleted first so runs don't pile up.
+    """
+    previous = st.session_state.get('last_output_path')
+    if previous and os.path.exists(previous):
+        try:
+            os.remove(previous)
+        except OSError as e:
+            print(f"[Output] Could not remove {previous}: {e}")
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    _sweep_old_outputs()
+    path = os.path.join(OUTPUT_DIR, f"{uuid.uuid4().hex[:12]}_{file_name}")
+    st.session_state.last_output_path = path
+    return path
+
+def _sweep_old_outputs():
+    """Deletes generated files older than OUTPUT_TTL_HOURS, whichever session wrote them."""
+    cutoff = time.time() - OUTPUT_TTL_HOURS * 3600
+    for name in os.listdir(OUTPUT_DIR):
+        path = os.path.join(OUTPUT_DIR, name)
+        try:
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)
+                print(f"[Output] Swept stale output {name}")
+        except OSError:
+            pass  # already gone, or still being written by another session
+
+def download_output(label, path, file_name, mime):
+    """Serves a generated output file through st.download_button."""
+    with open(path, "rb") as f:
+        st.download_button(label, data=f, file_name=file_name, mime=mime)
+
+def read_pdf_attachment(file_obj):
+    """
+    Returns the raw bytes of a PDF attachment that pypdf can open, so its
+    pages can be spliced into the booklet natively (crisp vector plans, no
+    re-encoding). Returns None for images, encrypted or unreadable PDFs —
+    those go through convert_file_to_images instead.
+    """
+    try:
+        file_obj.seek(0)
+        file_bytes = file_obj.read()
+        if file_bytes[:4] != b'%PDF':
+            return None
+        reader = PdfReader(BytesIO(file_bytes))
+        if reader.is_encrypted or len(reader.pages) == 0:
+            return None
+        return file_bytes
+    except Exception as e:
+        print(f"[Attach] Falling back to raster for {getattr(file_obj, 'name', 'attachment')}: {e}")
+        return None
 
 def auto_download_plan(url, session_cookie, cookie_name="ASP.NET_SessionId"):
     """
@@ -705,18 +977,49 @@ def parse_seqta_contact_pdf_app(pdf_file):
                 records.append({**ni,**ci,"dob":dob_val,"_raw_name":name_raw,"_raw_contacts":"\n".join(clns)})
     return records
 
+def _sc_dob(value):
+    """Normalises a Seqta PDF (d/mm/yy[yy]) or student-list (YYYY-MM-DD) birth date to YYYY-MM-DD."""
+    value=str(value or '').strip()
+    for fmt in ('%d/%m/%Y','%d/%m/%y','%Y-%m-%d'):
+        try: return datetime.strptime(value,fmt).strftime('%Y-%m-%d')
+        except ValueError: pass
+    return ''
+
 def match_seqta_contacts_app(pdf_records, df_students):
     id_col=COLS.get('student_id','Code'); fn_col=COLS.get('first_name','First name'); sn_col=COLS.get('surname','Surname')
     exact={}; sur_map={}
+    # Composite DOB keys: siblings / shared surnames almost never share a birth
+    # date, so (surname, DOB) — or (surname, first initial, DOB) for twins —
+    # picks the student directly where the name-only keys are ambiguous.
+    by_dob={}; by_init_dob={}
     for _,row in df_students.iterrows():
         sid=str(row.get(id_col,'')).strip(); first=str(row.get(fn_col,'')).strip().lower(); sur=str(row.get(sn_col,'')).strip().lower()
         if not sid or not sur: continue
         exact[(sur,first)]=sid; sur_map.setdefault(sur,[]).append(sid)
+        dob=_sc_dob(row.get('Birth date', row.get('Birth Date', '')))
+        if dob:
+            by_dob.setdefault((sur,dob),[]).append(sid)
+            pref=str(row.get('Preferred name','')).strip().lower()
+            for initial in {first[:1], pref[:1]} - {''}:
+                by_init_dob.setdefault((sur,initial,dob),[]).append(sid)
+    def _dob_match(sur,first,pref,dob):
+        for initial in (first[:1], pref[:1]):
+            cands=by_init_dob.get((sur,initial,dob),[]) if initial else []
+            if len(cands)==1: return cands[0]
+        cands=by_dob.get((sur,dob),[])
+        return cands[0] if len(cands)==1 else None
     matched,unmatched,ambiguous={},{},[]  # use dict for ambiguous clarity
-    unmatched_list=[]
+    unmatched_list=[]; n_dob=0
     for rec in pdf_records:
         sur=rec.get('surname','').strip().lower(); first=rec.get('first_name','').strip().lower(); pref=rec.get('preferred','').strip().lower()
         sid=None
+        dob=_sc_dob(rec.get('dob',''))
+        if dob and by_dob:
+            sid=_dob_match(sur,first,pref,dob)
+            if sid is None:
+                sur_tt=re.sub(r'ti','tt',sur)
+                if sur_tt!=sur: sid=_dob_match(sur_tt,re.sub(r'ti','tt',first),re.sub(r'ti','tt',pref),dob)
+            if sid: n_dob+=1; matched[sid]=rec; continue
         if (sur,first) in exact: sid=exact[(sur,first)]
         elif pref and pref!=first and (sur,pref) in exact: sid=exact[(sur,pref)]
         else:
@@ -734,6 +1037,8 @@ def match_seqta_contacts_app(pdf_records, df_students):
                     elif len(cands)>1: ambiguous.append((rec,cands)); continue
         if sid: matched[sid]=rec
         else: unmatched_list.append(rec)
+    print(f"[Seqta] Matched {len(matched)} ({n_dob} by surname + DOB), "
+          f"{len(unmatched_list)} unmatched, {len(ambiguous)} ambiguous")
     return matched, unmatched_list, ambiguous
 
 def home_contacts_from_pdf(pdf_rec):
@@ -846,94 +1151,106 @@ def _build_parent_lookup_from_pdf(seqta_matched):
     return lookup
 
 
-def _read_and_dedup_csv(file_obj):
+# Paperly form exports. Swimming and dietary exports carry one more data
+# column than header names, so they are read with explicit names.
+SWIMMING_CSV_COLUMNS = ['Email', 'First Name', 'Surname', 'Student', 'Submission Time', 'Status', 'Swimming Ability']
+DIETARY_CSV_COLUMNS  = ['Email', 'First Name', 'Surname', 'Student', 'Submission Time', 'Status', 'Dietary Requirements']
+
+@st.cache_data(show_spinner=False, max_entries=64)
+def _parse_paperly_csv(file_hash, _file_bytes, col_names=None):
     """
-    Reads a Paperly-format CSV (Email, First Name, Surname, Submission Time, Status, Value)
-    and deduplicates rows by email, keeping the most recent submission.
-    Returns the cleaned DataFrame.
+    Parses one uploaded Paperly CSV into string columns (blanks as "").
+    Cached by file_hash across reruns; the bytes themselves aren't hashed.
     """
-    if hasattr(file_obj, 'seek'):
-        file_obj.seek(0)
-    df = pd.read_csv(file_obj).fillna("")
-
-    col_email = df.columns[0]
-    col_time  = df.columns[3]
-
-    df[col_time] = pd.to_datetime(df[col_time], errors='coerce')
-    has_email = df[df[col_email].astype(str).str.strip() != ""]
-    no_email  = df[df[col_email].astype(str).str.strip() == ""]
-    deduped = (
-        has_email
-        .sort_values(col_time, ascending=False)
-        .drop_duplicates(subset=[col_email], keep='first')
-    )
-    return pd.concat([deduped, no_email], ignore_index=True)
+    if col_names:
+        df = pd.read_csv(BytesIO(_file_bytes), names=col_names, skiprows=1)
+    else:
+        df = pd.read_csv(BytesIO(_file_bytes))
+    return df.fillna("").astype(str)
 
-def collate_csvs(file_list):
+def load_paperly_csvs(file_list, col_names=None, email_col='Email', time_col='Submission Time'):
     """
-    Accepts a list of Streamlit UploadedFile objects (all CSVs with the same
-    column structure) and concatenates them into a single BytesIO object that
-    looks identical to one uploaded file.  This lets the existing matching
-    functions work completely unchanged whether the user uploads one file or ten.
+    Parses every upload for one Paperly form (each file once, cached by
+    content hash), stacks them and keeps only the most recent submission
+    per email. Rows without an email are all kept, after the deduped ones.
+    email_col / time_col may be names or column positions; if the form has
+    neither column the rows are returned undeduplicated.
 
-    Deduplication is handled later inside each matching function (by email +
-    Submission Time), so simple concatenation here is safe.
-
-    Returns a BytesIO on success, or None if file_list is empty/None.
+    Returns the cleaned DataFrame, or None if nothing could be read.
     """
-    if not file_list:
-        return None
-
     frames = []
-    header = None
-
-    for f in file_list:
+    for f in file_list or []:
         try:
-            if hasattr(f, 'seek'):
-                f.seek(0)
-            df = pd.read_csv(f)
-            if header is None:
-                header = list(df.columns)
-            frames.append(df)
+            data = f.getvalue() if hasattr(f, 'getvalue') else f.read()
+            frames.append(_parse_paperly_csv(hashlib.sha256(data).hexdigest(), data, col_names))
         except Exception as e:
-            print(f"[collate_csvs] Could not read '{getattr(f, 'name', '?')}': {e}")
-
+            print(f"[Paperly] Could not read '{getattr(f, 'name', '?')}': {e}")
     if not frames:
         return None
+    df = pd.concat(frames, ignore_index=True)
+
+    if isinstance(email_col, int):
+        email_col = df.columns[email_col]
+    if isinstance(time_col, int):
+        time_col = df.columns[time_col]
+    if email_col not in df.columns or time_col not in df.columns:
+        return df
+
+    has_email = df[email_col].str.strip() != ""
+    order = (
+        pd.to_datetime(df.loc[has_email, time_col], errors='coerce')
+        .sort_values(ascending=False, kind='stable')
+        .index
+    )
+    keep = ~df.loc[order, email_col].duplicated()
+    cleaned = pd.concat([df.loc[order[keep.to_numpy()]], df[~has_email]], ignore_index=True)
+    print(f"[Paperly] {len(df)} rows from {len(frames)} file(s), {len(cleaned)} after dedup")
+    return cleaned
 
-    combined = pd.concat(frames, ignore_index=True)
-    buf = BytesIO()
-    combined.to_csv(buf, index=False)
-    buf.seek(0)
-    buf.name = "collated.csv"   # give it a .name so downstream code is happy
-    return buf
 
+def suggested_student_select(key, suggestions, selections, item_key,
+                             student_options, id_to_label_map, name_to_id_map):
+    """
+    'Assign to student' selectbox for one unmatched record: fuzzy suggestions
+    are listed first with their scores, and the current (or auto-accepted)
+    choice is pre-selected. Keeps selections[item_key] in sync.
+    """
+    suggested = [id_to_label_map[sid] for sid, _ in suggestions if sid in id_to_label_map]
+    if suggested:
+        st.caption("Closest: " + " · ".join(
+            f"{id_to_label_map[sid]} ({score:.0%})" for sid, score in suggestions if sid in id_to_label_map
+        ))
+    options = ["(Skip)"] + suggested + [o for o in student_options[1:] if o not in suggested]
+    chosen = selections.get(item_key)
+    sel = st.selectbox(
+        "Assign to student:", options=options,
+        index=options.index(id_to_label_map[chosen]) if chosen in id_to_label_map else 0,
+        key=key
+    )
+    if sel != "(Skip)":
+        selections[item_key] = name_to_id_map[sel]
+    elif item_key in selections:
+        del selections[item_key]
 
-def match_swimming_ability(df_main, swimming_csv, contact_df=None):
+def match_swimming_ability(df_main, swimming_csv, contact_df=None, roster_index=None):
     """
     Matches swimming ability to students by searching for the student's surname
     within the 'Student' column of the swimming CSV.
 
-    CSV format (7 cols, 6 headers — Email used as implicit index by pandas):
+    Takes the form as cleaned by load_paperly_csvs() (read with explicit
+    column names, deduplicated by email):
       Email, First Name, Surname, Student, Submission Time, [Status], Swimming Ability
 
-    Read with explicit column names to avoid the index-shift problem.
-
     Strategy:
     - Unique surname  → match if surname appears as a whole word in Student field
     - Duplicate surnames → require surname + first/preferred name both present
-    - Deduplicates by email, keeping the most recent submission
     """
     if swimming_csv is None:
         print("\n⚠️  No swimming CSV provided - skipping")
         return {}, []
 
     try:
-        if hasattr(swimming_csv, 'seek'):
-            swimming_csv.seek(0)
-
-        col_names = ['Email', 'First Name', 'Surname', 'Student', 'Submission Time', 'Status', 'Swimming Ability']
-        swim_df = pd.read_csv(swimming_csv, names=col_names, skiprows=1).fillna("")
+        swim_df = swimming_csv
 
         student_col = 'Student'
         ability_col = 'Swimming Ability'
@@ -942,85 +1259,37 @@ def match_swimming_ability(df_main, swimming_csv, contact_df=None):
         print("SWIMMING ABILITY MATCHING")
         print(f"{'='*80}")
         print(f"Columns: {list(swim_df.columns)}")
-        print(f"Total rows: {len(swim_df)}")
-
-        # Deduplicate by email, keep most recent
-        swim_df['_time'] = pd.to_datetime(swim_df['Submission Time'], errors='coerce')
-        has_email = swim_df[swim_df['Email'].str.strip() != ""]
-        no_email  = swim_df[swim_df['Email'].str.strip() == ""]
-        deduped = has_email.sort_values('_time', ascending=False).drop_duplicates(subset=['Email'], keep='first')
-        swim_df = pd.concat([deduped, no_email], ignore_index=True)
-        print(f"Rows after dedup: {len(swim_df)}")
-
-        # Identify duplicate student surnames in the main list
-        surname_counts = {}
-        for _, row in df_main.iterrows():
-            s = str(row[COLS['surname']]).strip().lower()
-            if s:
-                surname_counts[s] = surname_counts.get(s, 0) + 1
-        duplicate_surnames = {s for s, c in surname_counts.items() if c > 1}
-        print(f"Duplicate surnames in student list: {len(duplicate_surnames)}")
+        print(f"Rows (after dedup): {len(swim_df)}")
 
-        matched = {}
-        unmatched = []
-        used_indices = set()
-        matched_count = 0
+        if roster_index is None:
+            roster_index = build_roster_name_index(df_main, COLS)
+        print(f"Duplicate surnames in student list: "
+              f"{len({r['surname_lower'] for r in roster_index if r['has_dup']})}")
 
         print(f"\n{'='*80}")
         print("MATCHING PROCESS")
         print(f"{'='*80}")
 
-        for _, student_row in df_main.iterrows():
-            student_id     = str(student_row[COLS['student_id']])
-            first_name     = str(student_row[COLS['first_name']]).strip()
-            preferred_name = str(student_row.get('Preferred name', '')).strip()
-            surname        = str(student_row[COLS['surname']]).strip()
+        names     = swim_df[student_col].astype(str).str.strip()
+        abilities = swim_df[ability_col].astype(str).str.strip()
+        usable    = [bool(a) and a.lower() not in ('nan', 'submitted') for a in abilities]
+        row_of    = match_names_to_roster(roster_index, names.str.lower().tolist(), usable)
 
-            if not surname:
+        matched = {}
+        unmatched = []
+        used_indices = set()
+        matched_count = 0
+        for student in roster_index:
+            pos = row_of.get(student['id'])
+            if pos is None:
+                if matched_count <= 10:
+                    print(f"[ ] ✗ {student['surname']}, {student['first_name']} (ID: {student['id']}) — not found in swimming CSV")
                 continue
-
-            surname_lower = surname.lower()
-            first_lower   = first_name.lower()
-            pref_lower    = preferred_name.lower()
-            has_dup       = surname_lower in duplicate_surnames
-
-            match_found = False
-            for swim_idx, swim_row in swim_df.iterrows():
-                if swim_idx in used_indices:
-                    continue
-
-                student_name_field = str(swim_row.get(student_col, '')).strip().lower()
-                ability = str(swim_row.get(ability_col, '')).strip()
-
-                if not ability or ability.lower() in ('nan', 'submitted', ''):
-                    continue
-
-                surname_pattern = r'\b' + re.escape(surname_lower) + r'\b'
-
-                if not has_dup:
-                    if re.search(surname_pattern, student_name_field):
-                        matched[student_id] = ability
-                        used_indices.add(swim_idx)
-                        match_found = True
-                        matched_count += 1
-                        if matched_count <= 5:
-                            print(f"[{matched_count}] ✓ {surname}, {first_name} → '{swim_row[student_col]}' : {ability}")
-                        break
-                else:
-                    surname_match = re.search(surname_pattern, student_name_field)
-                    first_match   = re.search(r'\b' + re.escape(first_lower) + r'\b', student_name_field) if first_lower else None
-                    pref_match    = re.search(r'\b' + re.escape(pref_lower)  + r'\b', student_name_field) if pref_lower  else None
-                    if surname_match and (first_match or pref_match):
-                        matched[student_id] = ability
-                        used_indices.add(swim_idx)
-                        match_found = True
-                        matched_count += 1
-                        if matched_count <= 5:
-                            print(f"[{matched_count}] ✓ {surname}, {first_name} → '{swim_row[student_col]}' : {ability}")
-                        break
-
-            if not match_found and matched_count <= 10:
-                print(f"[ ] ✗ {surname}, {first_name} (ID: {student_id}) — not found in swimming CSV")
+            matched[student['id']] = abilities.iloc[pos]
+            used_indices.add(swim_df.index[pos])
+            matched_count += 1
+            if matched_count <= 5:
+                print(f"[{matched_count}] ✓ {student['surname']}, {student['first_name']} → '{names.iloc[pos]}' : {abilities.iloc[pos]}")
 
         # Collect unmatched swimming rows for manual assignment
         for swim_idx, swim_row in swim_df.iterrows():
@@ -1053,27 +1322,21 @@ def get_swimming_display_color(ability):
     else:
         return 'swim-ok'
 
-def match_dietary_requirements(df_main, dietary_csv, contact_csv=None):
+def match_dietary_requirements(df_main, dietary_csv, contact_csv=None, roster_index=None):
     """
     Matches dietary requirements to students by searching for the student's surname
     within the 'Student' column of the dietary CSV.
 
-    CSV format (7 cols, 6 headers — Email used as implicit index by pandas):
+    Takes the form as cleaned by load_paperly_csvs() (read with explicit
+    column names, deduplicated by email):
       Email, First Name, Surname, Student, Submission Time, [Status], Dietary Requirements
 
-    Read with explicit column names to avoid the index-shift problem.
-
     Strategy:
     - Unique surname  → match if surname appears as a whole word in Student field
     - Duplicate surnames → require surname + first/preferred name both present
-    - Deduplicates by email, keeping the most recent submission
     """
     try:
-        if hasattr(dietary_csv, 'seek'):
-            dietary_csv.seek(0)
-
-        col_names = ['Email', 'First Name', 'Surname', 'Student', 'Submission Time', 'Status', 'Dietary Requirements']
-        dietary_df = pd.read_csv(dietary_csv, names=col_names, skiprows=1).fillna("")
+        dietary_df = dietary_csv
 
         student_col = 'Student'
         dietary_col = 'Dietary Requirements'
@@ -1082,86 +1345,39 @@ def match_dietary_requirements(df_main, dietary_csv, contact_csv=None):
         print("DIETARY REQUIREMENTS MATCHING")
         print(f"{'='*80}")
         print(f"Columns: {list(dietary_df.columns)}")
-        print(f"Total rows: {len(dietary_df)}")
-
-        # Deduplicate by email, keep most recent
-        dietary_df['_time'] = pd.to_datetime(dietary_df['Submission Time'], errors='coerce')
-        has_email = dietary_df[dietary_df['Email'].str.strip() != ""]
-        no_email  = dietary_df[dietary_df['Email'].str.strip() == ""]
-        deduped = has_email.sort_values('_time', ascending=False).drop_duplicates(subset=['Email'], keep='first')
-        dietary_df = pd.concat([deduped, no_email], ignore_index=True)
-        print(f"Rows after dedup: {len(dietary_df)}")
-
-        # Identify duplicate student surnames
-        surname_counts = {}
-        for _, row in df_main.iterrows():
-            s = str(row[COLS['surname']]).strip().lower()
-            if s:
-                surname_counts[s] = surname_counts.get(s, 0) + 1
-        duplicate_surnames = {s for s, c in surname_counts.items() if c > 1}
-        print(f"Duplicate surnames in student list: {len(duplicate_surnames)}")
+        print(f"Rows (after dedup): {len(dietary_df)}")
 
-        matched = {}
-        unmatched = []
-        used_indices = set()
-        matched_count = 0
+        if roster_index is None:
+            roster_index = build_roster_name_index(df_main, COLS)
+        print(f"Duplicate surnames in student list: "
+              f"{len({r['surname_lower'] for r in roster_index if r['has_dup']})}")
 
         print(f"\n{'='*80}")
         print("MATCHING PROCESS")
         print(f"{'='*80}")
 
-        for _, student_row in df_main.iterrows():
-            student_id     = str(student_row[COLS['student_id']])
-            first_name     = str(student_row[COLS['first_name']]).strip()
-            preferred_name = str(student_row.get('Preferred name', '')).strip()
-            surname        = str(student_row[COLS['surname']]).strip()
+        names  = dietary_df[student_col].astype(str).str.strip()
+        row_of = match_names_to_roster(roster_index, names.str.lower().tolist())
 
-            if not surname:
+        matched = {}
+        unmatched = []
+        used_indices = set()
+        matched_count = 0
+        for student in roster_index:
+            pos = row_of.get(student['id'])
+            if pos is None:
+                if matched_count <= 10:
+                    print(f"[ ] ✗ {student['surname']}, {student['first_name']} (ID: {student['id']}) — not found in dietary CSV")
                 continue
-
-            surname_lower = surname.lower()
-            first_lower   = first_name.lower()
-            pref_lower    = preferred_name.lower()
-            has_dup       = surname_lower in duplicate_surnames
-
-            match_found = False
-            for diet_idx, diet_row in dietary_df.iterrows():
-                if diet_idx in used_indices:
-                    continue
-
-                student_name_field = str(diet_row.get(student_col, '')).strip().lower()
-                dietary_req = str(diet_row.get(dietary_col, '')).strip()
-
-                # Normalise empty / nil / N/A
-                if not dietary_req or dietary_req.lower() in ('nan', 'submitted', '', 'nil', 'n/a'):
-                    dietary_req = "No concerns listed"
-
-                surname_pattern = r'\b' + re.escape(surname_lower) + r'\b'
-
-                if not has_dup:
-                    if re.search(surname_pattern, student_name_field):
-                        matched[student_id] = dietary_req
-                        used_indices.add(diet_idx)
-                        match_found = True
-                        matched_count += 1
-                        if matched_count <= 5:
-                            print(f"[{matched_count}] ✓ {surname}, {first_name} → '{diet_row[student_col]}' : {dietary_req[:50]}...")
-                        break
-                else:
-                    surname_match = re.search(surname_pattern, student_name_field)
-                    first_match   = re.search(r'\b' + re.escape(first_lower) + r'\b', student_name_field) if first_lower else None
-                    pref_match    = re.search(r'\b' + re.escape(pref_lower)  + r'\b', student_name_field) if pref_lower  else None
-                    if surname_match and (first_match or pref_match):
-                        matched[student_id] = dietary_req
-                        used_indices.add(diet_idx)
-                        match_found = True
-                        matched_count += 1
-                        if matched_count <= 5:
-                            print(f"[{matched_count}] ✓ {surname}, {first_name} → '{diet_row[student_col]}' : {dietary_req[:50]}...")
-                        break
-
-            if not match_found and matched_count <= 10:
-                print(f"[ ] ✗ {surname}, {first_name} (ID: {student_id}) — not found in dietary CSV")
+            dietary_req = str(dietary_df[dietary_col].iloc[pos]).strip()
+            # Normalise empty / nil / N/A
+            if not dietary_req or dietary_req.lower() in ('nan', 'submitted', '', 'nil', 'n/a'):
+                dietary_req = "No concerns listed"
+            matched[student['id']] = dietary_req
+            used_indices.add(dietary_df.index[pos])
+            matched_count += 1
+            if matched_count <= 5:
+                print(f"[{matched_count}] ✓ {student['surname']}, {student['first_name']} → '{names.iloc[pos]}' : {dietary_req[:50]}...")
 
         # Collect unmatched dietary rows for manual assignment
         for diet_idx, diet_row in dietary_df.iterrows():
@@ -1198,23 +1414,10 @@ def parse_camp_medication_csv(camp_csv):
     Returns a dict:
         { student_name_lower: { 'display_name': str, 'medications': [str] } }
     Only includes students who answered "Yes" to needing medication.
-    Deduplicates by email, keeping the most-recent submission.
+    camp_csv is the DataFrame from load_paperly_csvs() (already deduplicated).
     """
     try:
-        if hasattr(camp_csv, 'seek'):
-            camp_csv.seek(0)
-
-        df = pd.read_csv(camp_csv).fillna("")
-
-        # Deduplicate by email (keep most-recent)
-        if 'Email' in df.columns and 'Submission Time' in df.columns:
-            df['_time'] = pd.to_datetime(df['Submission Time'], errors='coerce')
-            has_email = df[df['Email'].str.strip() != ""]
-            no_email  = df[df['Email'].str.strip() == ""]
-            deduped = (has_email
-                       .sort_values('_time', ascending=False)
-                       .drop_duplicates(subset=['Email'], keep='first'))
-            df = pd.concat([deduped, no_email], ignore_index=True)
+        df = camp_csv
 
         # Find the "needs medication" column
         needs_col = next(
@@ -1265,7 +1468,7 @@ def parse_camp_medication_csv(camp_csv):
         return {}
 
 
-def match_camp_medications(df_main, camp_csv):
+def match_camp_medications(df_main, camp_csv, roster_index=None):
     """
     Matches parsed camp medication data to student IDs in df_main.
     Uses surname-first matching (same strategy as dietary).
@@ -1279,55 +1482,23 @@ def match_camp_medications(df_main, camp_csv):
     if not camp_data:
         return {}, []
 
-    # Build duplicate-surname set
-    surname_counts = {}
-    for _, row in df_main.iterrows():
-        s = str(row[COLS['surname']]).strip().lower()
-        if s:
-            surname_counts[s] = surname_counts.get(s, 0) + 1
-    duplicate_surnames = {s for s, c in surname_counts.items() if c > 1}
+    if roster_index is None:
+        roster_index = build_roster_name_index(df_main, COLS)
+
+    keys   = list(camp_data)
+    row_of = match_names_to_roster(roster_index, keys)
 
     matched   = {}
     used_keys = set()
-
-    for _, student_row in df_main.iterrows():
-        student_id     = str(student_row[COLS['student_id']])
-        first_name     = str(student_row[COLS['first_name']]).strip()
-        preferred_name = str(student_row.get('Preferred name', '')).strip()
-        surname        = str(student_row[COLS['surname']]).strip()
-
-        if not surname:
+    for student in roster_index:
+        pos = row_of.get(student['id'])
+        if pos is None:
             continue
-
-        surname_lower = surname.lower()
-        first_lower   = first_name.lower()
-        pref_lower    = preferred_name.lower()
-        has_dup       = surname_lower in duplicate_surnames
-
-        surname_pat = re.compile(r'\b' + re.escape(surname_lower) + r'\b')
-
-        for key, data in camp_data.items():
-            if key in used_keys:
-                continue
-            if not has_dup:
-                if surname_pat.search(key):
-                    matched[student_id] = {
-                        'name': f"{first_name} {surname}",
-                        'medications': data['medications']
-                    }
-                    used_keys.add(key)
-                    break
-            else:
-                if surname_pat.search(key):
-                    first_pat = re.compile(r'\b' + re.escape(first_lower) + r'\b') if first_lower else None
-                    pref_pat  = re.compile(r'\b' + re.escape(pref_lower)  + r'\b') if pref_lower  else None
-                    if (first_pat and first_pat.search(key)) or (pref_pat and pref_pat.search(key)):
-                        matched[student_id] = {
-                            'name': f"{first_name} {surname}",
-                            'medications': data['medications']
-                        }
-                        used_keys.add(key)
-                        break
+        matched[student['id']] = {
+            'name': f"{student['first_name']} {student['surname']}",
+            'medications': camp_data[keys[pos]]['medications']
+        }
+        used_keys.add(keys[pos])
 
     # Collect unmatched rows for manual assignment
     unmatched = [
@@ -1340,6 +1511,18 @@ def match_camp_medications(df_main, camp_csv):
     return matched, unmatched
 
 
+def _photo_permissions_key(df_main, perm_df):
+    """Hash of everything match_photo_permissions() reads, for memoising it."""
+    h = hashlib.sha256()
+    for frame in (df_main, perm_df, st.session_state.get('contact_csv_df')):
+        if frame is not None:
+            h.update(repr(list(frame.columns)).encode())
+            h.update(pd.util.hash_pandas_object(frame.astype(str), index=False).values.tobytes())
+        h.update(b"|")
+    for key in ('seqta_contact_matched', 'seqta_contact_manual', 'seqta_contact_unmatched'):
+        h.update(json.dumps(st.session_state.get(key), sort_keys=True, default=str).encode())
+    return h.hexdigest()
+
 def match_photo_permissions(df_main, photo_perm_csv):
     """
     Matches photo permission responses to students using a three-tier strategy:
@@ -1358,9 +1541,19 @@ def match_photo_permissions(df_main, photo_perm_csv):
     Any 'No' answer → 'No'. No match found → 'No Response'.
 
     CSV format: Email, First Name, Surname, Submission Time, Status, Q1, Q2
+    (photo_perm_csv is the DataFrame from load_paperly_csvs(), deduplicated.)
+
+    The result is memoised per session, so a Generate with the same inputs as
+    the scan reuses it.
     """
     try:
-        df = _read_and_dedup_csv(photo_perm_csv)
+        memo_key = _photo_permissions_key(df_main, photo_perm_csv)
+        memo = st.session_state.get('_photo_perm_memo')
+        if memo and memo[0] == memo_key:
+            print("[Photo Perms] Inputs unchanged — reusing previous result")
+            return dict(memo[1])
+
+        df = photo_perm_csv
 
         col_first   = df.columns[1]
         col_surname = df.columns[2]
@@ -1387,19 +1580,44 @@ def match_photo_permissions(df_main, photo_perm_csv):
             if p_first and p_surname:
                 perm_records.append({'first': p_first, 'surname': p_surname, 'result': result})
 
-        def _name_matches_perm(emerg_name_lower, perm):
+        # ── Index records by (first-name token, surname token) ────────────
+        # A whole-word match of both names implies the first word of each is
+        # a word of the contact name, so a contact name's candidate records
+        # are found by looking up every pair of its words; only those are
+        # then checked with the (precompiled) whole-word patterns.
+        perm_index   = {}
+        always_check = []   # names with no word characters — check directly
+        perms_by_surname = {}
+        for i, perm in enumerate(perm_records):
+            perm['first_pat']   = whole_word(perm['first'])
+            perm['surname_pat'] = whole_word(perm['surname'])
+            first_tokens   = NAME_TOKEN_RE.findall(perm['first'])
+            surname_tokens = NAME_TOKEN_RE.findall(perm['surname'])
+            if first_tokens and surname_tokens:
+                perm_index.setdefault((first_tokens[0], surname_tokens[0]), []).append(i)
+            else:
+                always_check.append(i)
+            perms_by_surname.setdefault(perm['surname'], []).append(i)
+
+        def _perms_naming(emerg_name_lower):
             """
-            Returns True if the permission record's first name AND surname
-            both appear as whole words within the emergency contact name string.
-            Handles middle names and any word order.
+            Permission records whose first name AND surname both appear as
+            whole words within the emergency contact name string, in form
+            order. Handles middle names and any word order.
             e.g. emerg_name = "jessica anne gray"
-                 perm first="jessica" surname="gray" → True
-                 perm first="jessica" surname="smith" → False
+                 perm first="jessica" surname="gray" → matched
+                 perm first="jessica" surname="smith" → not matched
             """
-            first_pat   = r'\b' + re.escape(perm['first'])   + r'\b'
-            surname_pat = r'\b' + re.escape(perm['surname']) + r'\b'
-            return (re.search(first_pat, emerg_name_lower) is not None and
-                    re.search(surname_pat, emerg_name_lower) is not None)
+            tokens = set(NAME_TOKEN_RE.findall(emerg_name_lower))
+            candidates = set(always_check)
+            for a in tokens:
+                for b in tokens:
+                    candidates.update(perm_index.get((a, b), ()))
+            return [
+                perm_records[i] for i in sorted(candidates)
+                if perm_records[i]['first_pat'].search(emerg_name_lower)
+                and perm_records[i]['surname_pat'].search(emerg_name_lower)
+            ]
 
         # ── Tier 2 prep: guardian lookup from Seqta PDF (incl. manual matches) ─
         seqta_matched = st.session_state.get('seqta_contact_matched', {}).copy()
@@ -1420,6 +1638,10 @@ def match_photo_permissions(df_main, photo_perm_csv):
             parent_lookup = _build_parent_surname_lookup(contact_df)
             source_label  = "Attendance CSV (SC1/SC2)"
         using_contact = bool(parent_lookup)
+        parent_surnames_by_sid = {}
+        for surname, entries in parent_lookup.items():
+            for entry in entries:
+                parent_surnames_by_sid.setdefault(entry['sid'], set()).add(surname)
         print(f"Emergency contacts: always active (first + last name required)")
         print(f"Parent lookup ({source_label}): {using_contact} ({len(parent_lookup)} surnames indexed)")
 
@@ -1472,18 +1694,22 @@ def match_photo_permissions(df_main, photo_perm_csv):
                         print(f"  [skip] emergency contact '{emerg_name}' matches student's own name — ignored")
                         continue
 
-                for perm in perm_records:
-                    if _name_matches_perm(emerg_name, perm):
-                        tier_desc = (f"emergency contact '{emerg_name}' "
-                                     f"matched '{perm['first']} {perm['surname']}'")
-                        confirmed_matches.append((perm['result'], tier_desc))
-                        # Keep going — don't break. A student may have two parents
-                        # both listed as emergency contacts who both filled the form.
+                for perm in _perms_naming(emerg_name):
+                    tier_desc = (f"emergency contact '{emerg_name}' "
+                                 f"matched '{perm['first']} {perm['surname']}'")
+                    confirmed_matches.append((perm['result'], tier_desc))
+                    # Keep going — don't break. A student may have two parents
+                    # both listed as emergency contacts who both filled the form.
 
             # ── Tier 2: Contact CSV SC1/SC2 — match perm first+last against
             #            the SC1/SC2 preferred+surname linked to this student
             if not confirmed_matches and using_contact:
-                for perm in perm_records:
+                # Only records whose surname is one of this student's contacts
+                linked = sorted({
+                    i for surname in parent_surnames_by_sid.get(sid, ())
+                    for i in perms_by_surname.get(surname, ())
+                })
+                for perm in (perm_records[i] for i in linked):
                     entries = parent_lookup.get(perm['surname'], [])
                     for entry in entries:
                         if entry['sid'] != sid:
@@ -1491,11 +1717,10 @@ def match_photo_permissions(df_main, photo_perm_csv):
                         # Surname matches and is linked to this student.
                         # Also require first name to match (or be blank in contact CSV).
                         contact_first = entry['first']
-                        first_pat = r'\b' + re.escape(perm['first']) + r'\b'
                         first_ok = (
                             not contact_first or
                             contact_first in ('nan', '') or
-                            re.search(first_pat, contact_first) is not None
+                            perm['first_pat'].search(contact_first) is not None
                         )
                         if first_ok:
                             tier_desc = f"contact CSV '{perm['first']} {perm['surname']}'"
@@ -1522,6 +1747,7 @@ def match_photo_permissions(df_main, photo_perm_csv):
         nr_count  = sum(1 for v in permissions.values() if v == 'No Response')
         print(f"\nResults: Yes={yes_count}  No={no_count}  No Response={nr_count}")
         print(f"{'='*80}\n")
+        st.session_state['_photo_perm_memo'] = (memo_key, dict(permissions))
         return permissions
 
     except Exception as e:
@@ -1747,92 +1973,83 @@ def parse_y8_camp_excel(uploaded_file):
     return result
 
 
-# ---------------------------------------------------------------------------
-# Ligature / unknown-glyph map.
-# The FB-block entries are standard Unicode ligatures.
-# The LIGATURE_MAP at module level is checked first; then any char
-# in the PUA range (E000-F8FF) that is NOT in the map is treated as
-# "tt" as a fallback (the most common unmapped school-photo glyph).
-# ---------------------------------------------------------------------------
-LIGATURE_MAP = {
-    "\ufb00": "ff",
-    "\ufb01": "fi",
-    "\ufb02": "fl",
-    "\ufb03": "ffi",
-    "\ufb04": "ffl",
-    "\ufb05": "st",
-    "\ufb06": "st",
-}
-
-# Accumulates any PUA chars we actually encounter, for the debug log.
-_SEEN_PUA_CHARS = set()
-
+def _pin_photo_pdf(photo_pdf_path):
+    """
+    Copies the uploaded photo PDF aside while hashing it. The upload path is
+    shared and any later upload overwrites it, so the scan and every later
+    orphan crop read this copy instead — exactly the bytes that were hashed.
+    Returns (sha256, path of the copy).
+    """
+    os.makedirs(PHOTO_CACHE_DIR, exist_ok=True)
+    copy_path = os.path.join(PHOTO_CACHE_DIR, f".upload-{uuid.uuid4().hex}.pdf")
+    h = hashlib.sha256()
+    with open(photo_pdf_path, "rb") as src, open(copy_path, "wb") as dst:
+        for chunk in iter(lambda: src.read(1 << 20), b""):
+            h.update(chunk)
+            dst.write(chunk)
+    return h.hexdigest(), copy_path
+
+def _photo_cache_load(cache_dir):
+    """Returns the cached scan index for one photo PDF, or None."""
+    try:
+        with open(os.path.join(cache_dir, "index.json"), encoding="utf-8") as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if index.get("version") != PHOTO_CACHE_VERSION:
+        return None
+    return index
+
+def _photo_cache_save(cache_dir, index):
+    # Write-then-rename so an interrupted scan never leaves a torn index. The
+    # scratch name is unique per write: sessions share one server process, and
+    # a concurrent scan of the same PDF simply replaces the whole index — at
+    # worst the other scan's pages are scanned again next time.
+    tmp_path = os.path.join(cache_dir, f".index-{uuid.uuid4().hex}.json")
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(index, f)
+        os.replace(tmp_path, os.path.join(cache_dir, "index.json"))
+        _prune_photo_cache()
+    except OSError as e:
+        print(f"[PhotoCache] Could not write index: {e}")
+
+def _touch_photo_cache(cache_dir):
+    """Marks a photo PDF's cache directory as in use, so pruning leaves it alone."""
+    if os.path.dirname(os.path.abspath(cache_dir)) != PHOTO_CACHE_DIR:
+        return
+    try:
+        os.utime(cache_dir)
+    except OSError:
+        pass
 
-def clean_ligatures(text):
+def _prune_photo_cache():
     """
-    Centralised ligature / glyph cleanup.
-    1. Known ligatures (FB block) are replaced by their expansions.
-    2. ANY Private-Use-Area character (U+E000–U+F8FF) not already in
-       LIGATURE_MAP is assumed to be 'tt' (by far the most common
-       unmapped glyph in school-photo PDFs) and replaced accordingly.
-       The char is also logged to _SEEN_PUA_CHARS for the debug dump.
-    3. Zero-width / invisible formatting chars are stripped.
-    4. Any run of 3+ identical letters is collapsed to exactly 2.
-       This handles pdfplumber emitting phantom duplicate chars after
-       a ligature glyph (e.g. [PUA]+"tt" -> "tttt" collapses to "tt").
-       No English surname has 3+ of the same letter in a row.
+    Keeps only the PHOTO_CACHE_MAX_PDFS most recently used photo PDFs. A
+    directory touched within PHOTO_CACHE_IN_USE_HOURS is always kept — some
+    session's matched photos or orphan records may still point into it.
     """
-    out = []
-    for ch in text:
-        cp = ord(ch)
-        # Known ligature?
-        if ch in LIGATURE_MAP:
-            out.append(LIGATURE_MAP[ch])
-        # PUA fallback — treat as 'tt'
-        elif 0xE000 <= cp <= 0xF8FF:
-            _SEEN_PUA_CHARS.add(ch)
-            out.append("tt")
-        # Zero-width / invisible — drop
-        elif cp in (0x200B, 0x200C, 0x200D, 0xFEFF):
+    entries = []
+    for name in os.listdir(PHOTO_CACHE_DIR):
+        cache_dir = os.path.join(PHOTO_CACHE_DIR, name)
+        if os.path.isfile(os.path.join(cache_dir, "index.json")):
+            entries.append((os.path.getmtime(cache_dir), name))
+    in_use_since = time.time() - PHOTO_CACHE_IN_USE_HOURS * 3600
+    for last_used, name in sorted(entries, reverse=True)[PHOTO_CACHE_MAX_PDFS:]:
+        if last_used >= in_use_since:
             continue
-        else:
-            out.append(ch)
-    # Collapse runs of 3+ identical letters -> 2
-    return re.sub(r'(.)\1{2,}', r'\1\1', "".join(out))
+        shutil.rmtree(os.path.join(PHOTO_CACHE_DIR, name), ignore_errors=True)
 
 
-def debug_dump_pua_chars():
-    """Call after scanning to see every PUA char that was hit."""
-    if _SEEN_PUA_CHARS:
-        print("=== PUA chars encountered (all mapped to 'tt') ===")
-        for ch in sorted(_SEEN_PUA_CHARS, key=ord):
-            print(f"  U+{ord(ch):04X}  repr={repr(ch)}")
-    else:
-        print("=== No PUA chars encountered ===")
-
-
-def debug_find_ligature_char(photo_pdf_path, target_fragment="ma"):
+def extract_photos_geometric(photo_pdf_path, df, max_workers=1, layout="free"):
     """
-    Scans every word in the PDF and prints repr() for any word
-    containing target_fragment (case-insensitive, after lowering).
-    Example: target_fragment="ma" will catch "Matthew", "Mattie", etc.
+    Generator over the photo PDF, one dict per page in page order:
+    { "page": n, "n_pages": N, "results": {sid: crop path},
+      "unmatched": [orphan…] }. Cached pages are yielded straight away;
+    the rest as they are scanned, so callers can show progress per page.
     """
-    import pdfplumber
-    with pdfplumber.open(photo_pdf_path) as pdf:
-        for page_num, page in enumerate(pdf.pages):
-            for w in page.extract_words():
-                if target_fragment in w['text'].lower():
-                    print(f"  Page {page_num+1} | raw repr: {repr(w['text'])} | "
-                          f"codepoints: {[f'U+{ord(c):04X}' for c in w['text']]}")
-# ---------------------------------------------------------------------------
-
-
-def extract_photos_geometric(photo_pdf_path, df):
-    results = {}
-    unmatched_data = []
-
     if not photo_pdf_path:
-        return results, unmatched_data
+        return
 
     print(f"\n--- Starting Geometric Extraction: {os.path.basename(photo_pdf_path)} ---")
 
@@ -1869,224 +2086,112 @@ def extract_photos_geometric(photo_pdf_path, df):
     print(f"[DEBUG] Loaded {total_students} students ({len(student_map)} unique surnames).")
 
     # ------------------------------------------------------------------
-    # 2. Constants
-    # ------------------------------------------------------------------
-    MAX_V_GAP        = 35    
-    LOOKAHEAD_FENCE = 40    
-    SAME_LINE_TOL    = 8     
-    COL_PAD          = 30
-
-    # ------------------------------------------------------------------
-    # 3. Walk the PDF
+    # 2. Re-scan only the pages the cache can't answer for this roster
     # ------------------------------------------------------------------
-    with pdfplumber.open(photo_pdf_path) as pdf:
-        for page_num, page in enumerate(pdf.pages):
-            print(f"\n[DEBUG] Processing Page {page_num + 1}...")
-            words  = page.extract_words()
-            images = page.images
-            claimed_images = set()
-
-            print(f"[DEBUG] Found {len(words)} words and {len(images)} images on page.")
-
-            # ----------------------------------------------------------
-            # A. NAME MATCHING
-            # ----------------------------------------------------------
-            i = 0
-            while i < len(words):
-                words_skipped = 1
-
-                for length in [5, 4, 3, 2, 1]:
-                    if i + length > len(words):
-                        continue
-
-                    phrase_objs = words[i : i + length]
-
-                    # SAME-LINE GUARD — with wrapped-surname relaxation.
-                    # Multi-word surnames (e.g. "Jarretto Handerstaay") and
-                    # hyphenated names with a space ("Duskett- McDann") can
-                    # wrap onto the next line in a narrow photo-label column.
-                    # In those cases the words' `top` values differ by one
-                    # full line height (~12 px), exceeding SAME_LINE_TOL=8
-                    # and causing a missed match.
-                    # For multi-word phrases we allow the relaxed tolerance
-                    # when the words stay inside the same narrow column
-                    # (x-centre spread < 70 px) and appear in reading order.
-                    tops = [w['top'] for w in phrase_objs]
-                    vertical_spread = max(tops) - min(tops)
-                    if vertical_spread > SAME_LINE_TOL:
-                        if length > 1:
-                            # Are all words horizontally within the same narrow column?
-                            x_centres = [(w['x0'] + w['x1']) / 2 for w in phrase_objs]
-                            same_col   = (max(x_centres) - min(x_centres)) < 70
-                            # Also allow when the first word ends in '-' (hyphenated wrap)
-                            is_hyphen_wrap = phrase_objs[0]['text'].rstrip().endswith('-')
-                            # Words must appear in descending / non-reversed order (top-to-bottom)
-                            in_order = all(
-                                phrase_objs[j]['top'] <= phrase_objs[j+1]['top'] + 5
-                                for j in range(len(phrase_objs) - 1)
-                            )
-                            if (same_col or is_hyphen_wrap) and in_order and vertical_spread <= 22:
-                                pass  # allow this wrapped multi-word phrase
-                            else:
-                                continue
-                        else:
-                            continue
-
-                    # Build key
-                    raw_text = "".join(w['text'] for w in phrase_objs).lower()
-                    text = clean_ligatures(raw_text)
-                    text = text.replace(",", "").replace(":", "").replace(".", "").replace("-", "").replace("'", "")
-
-                    if text not in student_map:
-                        continue
-                    
-                    # --- FOUND A SURNAME MATCH ---
-                    candidates = student_map[text]
-                    
-                    # Spatial bounds
-                    surname_bottom = max(w['bottom'] for w in phrase_objs)
-                    phrase_x0      = min(w['x0']      for w in phrase_objs)
-                    phrase_x1      = max(w['x1']      for w in phrase_objs)
-                    col_x0 = phrase_x0 - COL_PAD
-                    col_x1 = phrase_x1 + COL_PAD
-
-                    # SPATIALLY-FILTERED LOOKAHEAD
-                    nearby_text_parts = []
-                    for w_any in words:
-                        if w_any['top'] < surname_bottom - 2: continue
-                        if w_any['top'] > surname_bottom + LOOKAHEAD_FENCE: continue
-                        if w_any['x1'] < col_x0 or w_any['x0'] > col_x1: continue
-                        nearby_text_parts.append(clean_ligatures(w_any['text'].lower()))
-
-                    nearby_text = " ".join(nearby_text_parts)
-
-                    # PICK THE STUDENT
-                    matched_student_id = None
-                    disambiguation_method = "Single Match"
-
-                    if len(candidates) == 1:
-                        matched_student_id = candidates[0]['id']
-                    else:
-                        disambiguation_method = "First Name"
-                        for cand in candidates:
-                            if cand['first'] and cand['first'] in nearby_text:
-                                matched_student_id = cand['id']
-                                break
-
-                        if matched_student_id is None:
-                            disambiguation_method = "Roll Group"
-                            for cand in candidates:
-                                if cand['roll'] and cand['roll'] in nearby_text:
-                                    matched_student_id = cand['id']
-                                    break
-
-                    if matched_student_id is None:
-                        print(f"  [DEBUG] AMBIGUOUS: Found surname '{text}' but could not match First/Roll in nearby text: '{nearby_text}'")
-                        continue
-                    
-                    print(f"  [DEBUG] MATCHED Name: '{text}' -> ID: {matched_student_id} (via {disambiguation_method})")
-
-                    # GEOMETRY: Find photo
-                    phrase_top = min(w['top'] for w in phrase_objs)
-                    phrase_cx  = (phrase_x0 + phrase_x1) / 2
-
-                    best_img_idx = None
-                    best_img     = None
-                    min_gap      = 9999
-
-                    for img_idx, img in enumerate(images):
-                        if img_idx in claimed_images: continue # Skip already taken
-                        
-                        img_bot = img['bottom']
-                        if img_bot >= phrase_top: continue # Not above
-
-                        gap = phrase_top - img_bot
-                        if gap > MAX_V_GAP: 
-                            # Debug log for rejection if it's kinda close but failed
-                            if gap < MAX_V_GAP + 20:
-                                print(f"    [Img {img_idx}] REJECTED: Too high (Gap {gap:.1f} > {MAX_V_GAP})")
-                            continue
-
-                        img_cx = (img['x0'] + img['x1']) / 2
-                        h_dist = abs(img_cx - phrase_cx)
-                        allowed_h_dist = (phrase_x1 - phrase_x0) / 2 + 40
-                        
-                        if h_dist > allowed_h_dist:
-                            # Debug log for rejection if aligned vertically but off horizontally
-                            print(f"    [Img {img_idx}] REJECTED: Off-center (Dist {h_dist:.1f} > {allowed_h_dist:.1f})")
-                            continue
-
-                        # If we get here, it's a valid candidate
-                        if gap < min_gap:
-                            min_gap      = gap
-                            best_img     = img
-                            best_img_idx = img_idx
-
-                    if best_img:
-                        print(f"    [Img {best_img_idx}] CLAIMED: Gap={min_gap:.1f}")
-                        try:
-                            claimed_images.add(best_img_idx)
-                            bbox = (best_img['x0'], best_img['top'],
-                                    best_img['x1'], best_img['bottom'])
-                            crop   = page.within_bbox(bbox)
-                            im_obj = crop.to_image(resolution=200).original
-                            save_path = os.path.join(
-                                TEMP_DIR, f"{matched_student_id}.jpg"
-                            )
-                            im_obj.save(save_path)
-                            results[matched_student_id] = save_path
-                        except Exception as e:
-                            print(f"    [ERROR] Saving image: {e}")
-                    else:
-                        print(f"    [WARNING] No valid image found above '{text}' (Max Gap: {MAX_V_GAP})")
-
-                    words_skipped = length
-                    break 
-
-                i += words_skipped
-
-            # ----------------------------------------------------------
-            # B. ORPHAN IMAGES
-            # ----------------------------------------------------------
-            for img_idx, img in enumerate(images):
-                if img_idx in claimed_images:
-                    continue
-                try:
-                    if (img['x1'] - img['x0']) < 30 or (img['bottom'] - img['top']) < 30:
-                        continue
-
-                    print(f"  [DEBUG] Orphan Image Found: Index {img_idx}")
-
-                    bbox   = (img['x0'], img['top'], img['x1'], img['bottom'])
-                    crop   = page.within_bbox(bbox)
-                    im_obj = crop.to_image(resolution=200).original
-
-                    unmatched_name = f"unmatched_p{page_num+1}_{img_idx}.jpg"
-                    save_path      = os.path.join(TEMP_DIR, unmatched_name)
-                    im_obj.save(save_path)
+    pdf_key, upload_copy = _pin_photo_pdf(photo_pdf_path)
+    roster_key = hashlib.sha256(json.dumps(student_map, sort_keys=True).encode()).hexdigest()
+    # Each layout mode matches differently, so each keeps its own entry; so
+    # does each cache version, as crops are reused by name across scans
+    cache_dir  = os.path.join(PHOTO_CACHE_DIR, f"{pdf_key}-{layout}-v{PHOTO_CACHE_VERSION}")
+    os.makedirs(cache_dir, exist_ok=True)
+    _touch_photo_cache(cache_dir)
+
+    # The scan, and any orphan crop cut later, read the PDF kept with its cache
+    source_path = os.path.join(cache_dir, "source.pdf")
+    if os.path.exists(source_path):
+        os.remove(upload_copy)
+    else:
+        os.replace(upload_copy, source_path)
+
+    index = _photo_cache_load(cache_dir)
+    if index is None:
+        with pdfplumber.open(source_path) as pdf:
+            n_pages = len(pdf.pages)
+        index = {"version": PHOTO_CACHE_VERSION, "n_pages": n_pages,
+                 "roster": None, "pages": {}}
+    pages = index["pages"]
+
+    if index["roster"] == roster_key:
+        stale = [n for n in range(index["n_pages"]) if str(n + 1) not in pages]
+    else:
+        # Roster changed: a page only needs re-matching if a surname it
+        # contains now maps to different students
+        surname_trie = build_surname_trie(student_map)
+        stale = [
+            n for n in range(index["n_pages"])
+            if str(n + 1) not in pages
+            or page_roster_fingerprint(pages[str(n + 1)]["word_keys"],
+                                       student_map, surname_trie) != pages[str(n + 1)]["roster"]
+        ]
+    print(f"[PhotoCache] {pdf_key[:12]}: reusing {index['n_pages'] - len(stale)} "
+          f"of {index['n_pages']} pages, scanning {len(stale)}")
 
-                    nearby_text = []
-                    img_bottom  = img['bottom']
-                    for w in words:
-                        # Look BELOW the orphan
-                        if img_bottom < w['top'] < (img_bottom + 50):
-                            if (w['x0'] < img['x1']) and (w['x1'] > img['x0']):
-                                nearby_text.append(clean_ligatures(w['text']))
+    # Only the index entries go: their crop files may still be in use by
+    # another session, and a re-scan reuses them anyway (see crop_name)
+    for n in stale:
+        pages.pop(str(n + 1), None)
+    # Stale pages are gone from the index now, so if the scan is interrupted
+    # the next run only has to scan the pages still missing
+    index["roster"] = roster_key
+    _photo_cache_save(cache_dir, index)
 
-                    found_text = " ".join(nearby_text) if nearby_text else "No text found immediately below"
-                    print(f"    -> Text below orphan: {found_text}")
+    scanned = extract_pages(source_path, student_map, cache_dir,
+                            max_workers=max_workers, page_nums=stale, layout=layout)
 
-                    unmatched_data.append({
-                        "path":       save_path,
-                        "text_found": found_text,
-                        "page":       page_num + 1,
-                    })
-                except Exception as e:
-                    print(f"    [ERROR] Processing orphan {img_idx}: {e}")
+    # ------------------------------------------------------------------
+    # 3. Walk pages in order, taking each from the cache or the scan
+    # ------------------------------------------------------------------
+    matched_on_page = {}
+    seen_pua = set()
+    n_matched = 0
+    for page_no in range(1, index["n_pages"] + 1):
+        if str(page_no) not in pages:
+            page = next(scanned)
+            # Crops are stored by file name so the entry stays valid if _temp moves
+            pages[str(page_no)] = {
+                "results":     {sid: os.path.basename(path) for sid, path in page["results"].items()},
+                "placements":  page["placements"],
+                "unmatched":   [dict(item, path=os.path.basename(item["path"]))
+                                for item in page["unmatched"]],
+                "diagnostics": page["diagnostics"],
+                "word_keys":   page["word_keys"],
+                "roster":      page["roster"],
+                "pua_chars":   sorted(page["pua_chars"]),
+            }
+            _photo_cache_save(cache_dir, index)
+
+        page = pages[str(page_no)]
+        seen_pua.update(page["pua_chars"])
+        results, unmatched_data = {}, []
+        for sid, name in page["results"].items():
+            path = os.path.join(cache_dir, name)
+            # The earliest page always wins. A later duplicate is kept as an
+            # orphan so it can still be assigned by hand.
+            if sid in matched_on_page:
+                print(f"  [DEBUG] DUPLICATE: {sid} already matched on page "
+                      f"{matched_on_page[sid]}; page {page_no} photo left for review")
+                # With its image index and bbox, so it can be cut again if
+                # the crop file is gone (see save_orphan_crop)
+                unmatched_data.append(dict(
+                    page["placements"][sid],
+                    path=path,
+                    source=source_path,
+                    text_found=f"Also matched {sid} on page {matched_on_page[sid]}",
+                    page=page_no,
+                ))
+                continue
+            results[sid] = path
+            matched_on_page[sid] = page_no
+        unmatched_data.extend(
+            dict(item, path=os.path.join(cache_dir, item["path"]), source=source_path)
+            for item in page["unmatched"]
+        )
+        n_matched += len(results)
+        yield {"page": page_no, "n_pages": index["n_pages"],
+               "results": results, "unmatched": unmatched_data}
 
-    debug_dump_pua_chars()
-    print(f"--- Finished. Extracted {len(results)} photos. ---\n")
-    return results, unmatched_data
+    debug_dump_pua_chars(seen_pua)
+    print(f"--- Finished. Extracted {n_matched} photos. ---\n")
 
 
 def image_to_a4_pdf(upload):
@@ -2737,7 +2842,13 @@ if t1 is not None:
             st.session_state.seqta_contact_unmatched = [
                 dict(rec, _index=i) for i, rec in enumerate(_all_unmatched)
             ]
-            st.session_state.seqta_contact_manual = {}
+            st.session_state.seqta_contact_manual = suggest_roster_matches(
+                build_fuzzy_name_index(build_roster_name_index(st.session_state.df_final, COLS)),
+                st.session_state.seqta_contact_unmatched,
+                lambda r: f"{r.get('preferred') or r.get('first_name', '')} {r.get('surname', '')}",
+                lambda r: r['_index'],
+                taken=_sc_matched, auto_accept=FUZZY_AUTO_ACCEPT
+            )
             n_m = len(_sc_matched); n_u = len(_all_unmatched)
             if n_u == 0:
                 st.success(f"✅ Excursion PDF: all {n_m} students matched")
@@ -2749,32 +2860,32 @@ if t1 is not None:
         st.warning("Upload the Student List CSV at the same time as the Excursion PDF.")
 
     if swimming_csv_files:
-        collated = collate_csvs(swimming_csv_files)
-        if collated:
+        collated = load_paperly_csvs(swimming_csv_files, col_names=SWIMMING_CSV_COLUMNS)
+        if collated is not None:
             st.session_state.swimming_csv = collated
             n = len(swimming_csv_files)
             label = f"{n} file{'s' if n > 1 else ''} combined" if n > 1 else "1 file"
             st.success(f"✅ Swimming ability CSV loaded ({label})")
 
     if dietary_csv_files:
-        collated = collate_csvs(dietary_csv_files)
-        if collated:
+        collated = load_paperly_csvs(dietary_csv_files, col_names=DIETARY_CSV_COLUMNS)
+        if collated is not None:
             st.session_state.dietary_csv = collated
             n = len(dietary_csv_files)
             label = f"{n} file{'s' if n > 1 else ''} combined" if n > 1 else "1 file"
             st.success(f"✅ Dietary requirements CSV loaded ({label})")
 
     if photo_perm_csv_files:
-        collated = collate_csvs(photo_perm_csv_files)
-        if collated:
+        collated = load_paperly_csvs(photo_perm_csv_files, email_col=0, time_col=3)
+        if collated is not None:
             st.session_state.photo_perm_csv = collated
             n = len(photo_perm_csv_files)
             label = f"{n} file{'s' if n > 1 else ''} combined" if n > 1 else "1 file"
             st.success(f"✅ Photo permissions CSV loaded ({label})")
 
     if camp_med_csv_files:
-        collated = collate_csvs(camp_med_csv_files)
-        if collated:
+        collated = load_paperly_csvs(camp_med_csv_files)
+        if collated is not None:
             st.session_state.camp_med_csv = collated
             n = len(camp_med_csv_files)
             label = f"{n} file{'s' if n > 1 else ''} combined" if n > 1 else "1 file"
@@ -2815,40 +2926,101 @@ if t2 is not None:
         # ── Step 1: Analyse ───────────────────────────────────────────────────────
         st.markdown('<div class="section-head">Step 1 — Analyse photos</div>', unsafe_allow_html=True)
 
+        parallel_scan = st.checkbox(
+            "Scan pages in parallel", value=True,
+            help="Spreads the photo PDF's pages across worker processes. "
+                 "Untick to scan one page at a time."
+        )
+        grid_layout = st.checkbox(
+            "Detect the photo grid", value=True,
+            help="Works out each page's rows and columns of photos and matches "
+                 "each name to the photo cell above it. Pages without a regular "
+                 "grid are matched photo by photo as before."
+        )
         if st.button("Scan & Match Photos", type="primary"):
-            with st.spinner("Scanning PDF and matching photos to students…"):
-                results, unmatched = extract_photos_geometric(photo_pdf_path, df_final)
-                st.session_state.auto_matches = results
-                st.session_state.unmatched_data = unmatched
+            st.session_state.auto_matches = {}
+            st.session_state.unmatched_data = []
+            st.session_state.extraction_done = False
+            st.session_state.photo_scan_incomplete = True
+            st.session_state.manual_selections = {}
+            st.session_state.orphan_thumbs = {}
+            st.session_state.photo_store = {}
+
+            # Pages stream in one at a time: matched counts and the photos
+            # needing review appear as each page finishes. Anything that
+            # reruns the app mid-scan stops it; scanned pages are cached, so
+            # scanning again picks up where it left off.
+            scan_progress = st.progress(0.0, text="Opening photo PDF…")
+            scan_preview  = st.container()
+            for page in extract_photos_geometric(
+                photo_pdf_path, df_final,
+                max_workers=default_extract_workers() if parallel_scan else 1,
+                layout="grid" if grid_layout else "free"
+            ):
+                st.session_state.auto_matches.update(page["results"])
+                st.session_state.unmatched_data.extend(page["unmatched"])
+                st.session_state.photo_scan_page = page["page"]
+                scan_progress.progress(
+                    page["page"] / page["n_pages"],
+                    text=f"Scanned page {page['page']} of {page['n_pages']} — "
+                         f"{len(st.session_state.auto_matches)} matched, "
+                         f"{len(st.session_state.unmatched_data)} to review"
+                )
+                if page["unmatched"]:
+                    with scan_preview:
+                        st.caption(
+                            f"Page {page['page']} — {len(page['unmatched'])} photo(s) to review: "
+                            + ", ".join(item['text_found'] for item in page["unmatched"])
+                        )
+            st.session_state.photo_scan_incomplete = False
+
+            with st.spinner("Matching the other uploads to students…"):
                 st.session_state.extraction_done = True
-                st.session_state.manual_selections = {}
                 st.session_state.detected_plans = detect_medical_plans(df_final)
+                # Compiled once and shared by the Paperly form matchers below
+                roster_index = build_roster_name_index(df_final, COLS)
+                fuzzy_index  = build_fuzzy_name_index(roster_index)
 
                 if 'swimming_csv' in st.session_state:
                     contact_data = st.session_state.get('contact_csv_df', None)
-                    swim_matched, swim_unmatched = match_swimming_ability(df_final, st.session_state.swimming_csv, contact_data)
+                    swim_matched, swim_unmatched = match_swimming_ability(df_final, st.session_state.swimming_csv, contact_data, roster_index=roster_index)
                     st.session_state.swimming_matched = swim_matched
                     st.session_state.swimming_unmatched = swim_unmatched
-                    st.session_state.swimming_manual_selections = {}
+                    st.session_state.swimming_manual_selections = suggest_roster_matches(
+                        fuzzy_index, swim_unmatched, lambda r: r['student_name'], lambda r: r['index'],
+                        taken=swim_matched, auto_accept=FUZZY_AUTO_ACCEPT
+                    )
 
                 if 'dietary_csv' in st.session_state:
-                    dietary_matched, dietary_unmatched = match_dietary_requirements(df_final, st.session_state.dietary_csv)
+                    dietary_matched, dietary_unmatched = match_dietary_requirements(df_final, st.session_state.dietary_csv, roster_index=roster_index)
                     st.session_state.dietary_matched = dietary_matched
                     st.session_state.dietary_unmatched = dietary_unmatched
-                    st.session_state.dietary_manual_selections = {}
+                    st.session_state.dietary_manual_selections = suggest_roster_matches(
+                        fuzzy_index, dietary_unmatched, lambda r: r['student_name'], lambda r: r['index'],
+                        taken=dietary_matched, auto_accept=FUZZY_AUTO_ACCEPT
+                    )
 
                 if 'photo_perm_csv' in st.session_state:
                     perm_map = match_photo_permissions(df_final, st.session_state.photo_perm_csv)
                     st.session_state.photo_permissions_map = perm_map
 
                 if 'camp_med_csv' in st.session_state:
-                    camp_matched, camp_unmatched = match_camp_medications(df_final, st.session_state.camp_med_csv)
+                    camp_matched, camp_unmatched = match_camp_medications(df_final, st.session_state.camp_med_csv, roster_index=roster_index)
                     st.session_state.camp_medication_matched   = camp_matched
                     st.session_state.camp_medication_unmatched = camp_unmatched
-                    st.session_state.camp_medication_manual    = {}
+                    st.session_state.camp_medication_manual    = suggest_roster_matches(
+                        fuzzy_index, camp_unmatched, lambda r: r['student_name'], lambda r: r['index'],
+                        taken=camp_matched, auto_accept=FUZZY_AUTO_ACCEPT
+                    )
 
                 st.rerun()
 
+        if st.session_state.get("photo_scan_incomplete", False):
+            st.warning(
+                f"The photo scan was interrupted after {st.session_state.get('photo_scan_page', 0)} page(s). "
+                "Click **Scan & Match Photos** to finish — pages already scanned load instantly."
+            )
+
         if st.session_state.get("extraction_done", False):
 
             # ── Step 2: Review photos ─────────────────────────────────────────────
@@ -2856,12 +3028,14 @@ if t2 is not None:
 
             student_options = ["(Skip)"]
             name_to_id_map = {}
+            id_to_label_map = {}
             id_to_name_map = {}
             for _, row in df_final.iterrows():
                 sid = str(row[COLS['student_id']])
                 label = f"{row[COLS['surname']]}, {row[COLS['first_name']]} ({sid})"
                 student_options.append(label)
                 name_to_id_map[label] = sid
+                id_to_label_map[sid] = label
                 id_to_name_map[sid] = f"{row[COLS['first_name']]} {row[COLS['surname']]}"
 
             # Photos
@@ -2869,14 +3043,50 @@ if t2 is not None:
             n_unmatched = len(st.session_state.unmatched_data)
             if n_unmatched > 0:
                 with st.expander(f"⚠️  {n_unmatched} photos need manual matching  ({n_auto} matched automatically)", expanded=True):
-                    for item in st.session_state.unmatched_data:
+                    n_review_pages = (n_unmatched - 1) // ORPHAN_REVIEW_PAGE_SIZE + 1
+                    review_page = 1
+                    if n_review_pages > 1:
+                        review_page = st.number_input(
+                            f"Page (of {n_review_pages})", min_value=1, max_value=n_review_pages,
+                            value=1, step=1, key="orphan_review_page"
+                        )
+                    start = (review_page - 1) * ORPHAN_REVIEW_PAGE_SIZE
+                    shown = st.session_state.unmatched_data[start:start + ORPHAN_REVIEW_PAGE_SIZE]
+
+                    # Keep the scan's cache directory from being pruned while
+                    # its orphans are still being reviewed
+                    for cache_dir in {os.path.dirname(item['path']) for item in shown}:
+                        _touch_photo_cache(cache_dir)
+
+                    # Thumbnails are made on first view and kept for the session
+                    thumbs = st.session_state.setdefault("orphan_thumbs", {})
+                    missing = [item for item in shown if item['path'] not in thumbs]
+                    if missing:
+                        thumbs.update(orphan_thumbnails(missing))
+
+                    for item in shown:
                         c1, c2 = st.columns([1, 4])
-                        with c1: st.image(item['path'], width=90)
+                        with c1:
+                            if thumbs.get(item['path']):
+                                st.image(thumbs[item['path']], width=90)
+                            else:
+                                st.caption("No preview")
                         with c2:
                             st.caption(f"Page {item['page']} · Text nearby: *{item['text_found']}*")
-                            sel = st.selectbox("Assign to student:", options=student_options, key=f"select_{item['path']}")
+                            # Restore the choice when paging back to this photo
+                            chosen = st.session_state.manual_selections.get(item['path'])
+                            sel = st.selectbox(
+                                "Assign to student:", options=student_options,
+                                index=student_options.index(id_to_label_map[chosen]) if chosen in id_to_label_map else 0,
+                                key=f"select_{item['path']}"
+                            )
                             if sel != "(Skip)":
-                                st.session_state.manual_selections[item['path']] = name_to_id_map[sel]
+                                # Full-size crop only now that it's actually needed
+                                if save_orphan_crop(item):
+                                    st.session_state.manual_selections[item['path']] = name_to_id_map[sel]
+                                else:
+                                    st.error("Could not crop this photo — its photo PDF is no longer "
+                                             "cached. Click **Scan & Match Photos** again.")
                             elif item['path'] in st.session_state.manual_selections:
                                 del st.session_state.manual_selections[item['path']]
                         st.divider()
@@ -2898,11 +3108,11 @@ if t2 is not None:
                                 color_map = {'swim-cannot': '🔴', 'swim-weak': '🟠', 'swim-ok': '🟢', 'swim-none': '⚪'}
                                 ability_color = get_swimming_display_color(item['ability'])
                                 st.markdown(f"{color_map.get(ability_color, '⚪')} {item['ability']}")
-                                sel = st.selectbox("Assign to student:", options=student_options, key=f"swim_select_{item['index']}")
-                                if sel != "(Skip)":
-                                    st.session_state.swimming_manual_selections[item['index']] = name_to_id_map[sel]
-                                elif item['index'] in st.session_state.swimming_manual_selections:
-                                    del st.session_state.swimming_manual_selections[item['index']]
+                                suggested_student_select(
+                                    f"swim_select_{item['index']}", item.get('suggestions', []),
+                                    st.session_state.swimming_manual_selections, item['index'],
+                                    student_options, id_to_label_map, name_to_id_map
+                                )
                             st.divider()
                 else:
                     st.success(f"✅ All {total_swim_matched} swimming records matched automatically")
@@ -2921,11 +3131,11 @@ if t2 is not None:
                             with c2:
                                 preview = item['dietary_req'][:100] + "…" if len(item['dietary_req']) > 100 else item['dietary_req']
                                 st.markdown(f"🍽️ {preview}")
-                                sel = st.selectbox("Assign to student:", options=student_options, key=f"dietary_select_{item['index']}")
-                                if sel != "(Skip)":
-                                    st.session_state.dietary_manual_selections[item['index']] = name_to_id_map[sel]
-                                elif item['index'] in st.session_state.dietary_manual_selections:
-                                    del st.session_state.dietary_manual_selections[item['index']]
+                                suggested_student_select(
+                                    f"dietary_select_{item['index']}", item.get('suggestions', []),
+                                    st.session_state.dietary_manual_selections, item['index'],
+                                    student_options, id_to_label_map, name_to_id_map
+                                )
                             st.divider()
                 else:
                     st.success(f"✅ All {total_diet_matched} dietary records matched automatically")
@@ -2947,11 +3157,11 @@ if t2 is not None:
                                 _phones = ' · '.join(filter(None, [_g.get('mobile'), _g.get('home'), _g.get('work')]))
                                 st.caption(f"{_g.get('relationship','')}: {_g.get('name','')}  {_phones}")
                         with _c2:
-                            _sel = st.selectbox("Assign to student:", options=student_options, key=f"sc_sel_{_idx}")
-                            if _sel != "(Skip)":
-                                st.session_state.seqta_contact_manual[_idx] = name_to_id_map[_sel]
-                            elif _idx in st.session_state.seqta_contact_manual:
-                                del st.session_state.seqta_contact_manual[_idx]
+                            suggested_student_select(
+                                f"sc_sel_{_idx}", _item.get('suggestions', []),
+                                st.session_state.seqta_contact_manual, _idx,
+                                student_options, id_to_label_map, name_to_id_map
+                            )
                         st.divider()
             elif _sc_matched:
                 st.success(f"✅ All {len(_sc_matched)} contact records matched automatically")
@@ -2982,11 +3192,11 @@ if t2 is not None:
                                 for _m in item['medications']:
                                     st.caption(f"💊 {_m[:80]}{'…' if len(_m)>80 else ''}")
                             with _c2:
-                                _sel = st.selectbox("Assign to student:", options=student_options, key=f"camp_med_sel_{_ck}")
-                                if _sel != "(Skip)":
-                                    st.session_state.camp_medication_manual[_ck] = name_to_id_map[_sel]
-                                elif _ck in st.session_state.camp_medication_manual:
-                                    del st.session_state.camp_medication_manual[_ck]
+                                suggested_student_select(
+                                    f"camp_med_sel_{_ck}", item.get('suggestions', []),
+                                    st.session_state.camp_medication_manual, _ck,
+                                    student_options, id_to_label_map, name_to_id_map
+                                )
                             st.divider()
                 elif camp_matched_st:
                     st.success(f"✅ Camp Medications: {len(camp_matched_st)} student(s) with medication matched automatically")
@@ -3283,6 +3493,35 @@ if t2 is not None:
                 else:
                     output_mode = st.radio("Output:", ["Single Document", f"Split by {sort_by}"])
 
+            # ── Parallel rendering ──
+            # Profile pages are laid out in blocks of `render_shard_size` students,
+            # one block per worker, and merged with the group front matter after.
+            _max_workers = max(1, os.cpu_count() or 1)
+            _rc1, _rc2 = st.columns(2)
+            with _rc1:
+                # A slider needs min < max, so a single-CPU host gets a fixed value
+                if _max_workers > 1:
+                    render_workers = st.slider(
+                        "Parallel render workers",
+                        min_value=1, max_value=_max_workers,
+                        value=min(default_render_workers(), _max_workers),
+                        help="Blocks of student profile pages and each group's front matter are "
+                             "laid out in separate worker processes. Set to 1 to render in-process.",
+                        key="render_workers_input"
+                    )
+                else:
+                    render_workers = 1
+                    st.caption("Rendering in-process — this machine has a single CPU.")
+            with _rc2:
+                render_shard_size = st.number_input(
+                    "Students per render block",
+                    min_value=5, max_value=500, value=40, step=5,
+                    help="Student pages are laid out in blocks of this many students and "
+                         "merged afterwards, which keeps memory flat on whole-cohort runs. "
+                         "Unchanged students are reused from the previous Generate.",
+                    key="render_shard_size_input"
+                )
+
             # ── Custom Groups builder (only shown when Custom Groups is selected) ──
             if sort_by == "Custom Groups":
                 st.markdown("<br>", unsafe_allow_html=True)
@@ -3511,6 +3750,12 @@ if t2 is not None:
                 }
 
                 all_records = []
+                booklet_date = datetime.now().strftime("%d %B %Y")
+                # img://… URL → image bytes, served to WeasyPrint by booklet_render's
+                # url_fetcher so each photo/attachment is decoded and embedded once
+                image_registry = {}
+                # attachment marker id → PDF bytes, spliced in natively after layout
+                pdf_attachments = {}
                 total = len(df_final)
 
                 # ── Animated adventure progress bar ──────────────────────────
@@ -3629,12 +3874,29 @@ if t2 is not None:
                             if not vals: vals = ["No data supplied."]
                             sections.append({"title": sec['section'], "type": "text", "content": vals})
 
-                    embedded = []
-                    if sid in plan_map:
-                        for f in plan_map[sid]:
-                            embedded.extend(convert_file_to_images(f))
-                    if sid in st.session_state.attachments:
-                        for f in st.session_state.attachments[sid]: embedded.extend(convert_file_to_images(f))
+                    # Attachments keep their upload order. PDFs are spliced in as
+                    # native pages after the block holding their marker anchor;
+                    # only image uploads (and PDFs pypdf can't open) are rasterised.
+                    attach_files = list(plan_map.get(sid, [])) + list(st.session_state.attachments.get(sid, []))
+                    embedded = []               # image attachment pages
+                    pdf_after_profile = []      # markers for PDFs before any image page
+                    for file_no, f in enumerate(attach_files):
+                        pdf_bytes = read_pdf_attachment(f)
+                        if pdf_bytes:
+                            marker = f"attach-{link_id}-{file_no}"
+                            pdf_attachments[marker] = pdf_bytes
+                            (embedded[-1]["pdf_after"] if embedded else pdf_after_profile).append(marker)
+                            continue
+                        for page_no, page_bytes in enumerate(convert_file_to_images(f)):
+                            url = f"img://attach/{link_id}/{file_no}/{page_no}"
+                            image_registry[url] = page_bytes
+                            embedded.append({"src": url, "pdf_after": []})
+
+                    photo_url = None
+                    rendition = photo_rendition(final_photo_map.get(sid))
+                    if rendition:
+                        photo_url = f"img://photo/{link_id}"
+                        image_registry[photo_url] = rendition
 
                     med_l = raw_med.lower()
                     c_disp = f"{parsed_con[0]['name']} ({parsed_con[0]['phones'][0]['display']})" if parsed_con else ""
@@ -3650,8 +3912,9 @@ if t2 is not None:
                         "swimming": swim_ability, "swim_color": swim_color,
                         "dietary": dietary_req,
                         "photo_perm": photo_perm_val,
-                        "photo": img_to_base64(final_photo_map.get(sid)),
+                        "photo": photo_url,
                         "sections": sections, "attachments": embedded,
+                        "pdf_after_profile": pdf_after_profile,
                         # Y8 camp survey data — None when not a camp booklet
                         "y8_camp": st.session_state.get("y8_camp_data", {}).get(sid, None)
                     }
@@ -3674,7 +3937,8 @@ if t2 is not None:
                 # ── Sort & group ──────────────────────────────────────────────
                 status.write("Sorting & grouping…")
 
-                def render_subset(records, title_suffix="", y8_camp_group=None):
+                def build_subset_html(records, title_suffix="", y8_camp_group=None,
+                                      mode="full", link_stubs=None):
                     s_list   = [r['profile'] for r in records]
                     m_list   = [r['matrix']  for r in records]
                     med_list = [r['medical'] for r in records if r['medical']]
@@ -3706,18 +3970,107 @@ if t2 is not None:
                     ] or None
                     _camp_days = st.session_state.get('camp_days', 3)
 
-                    full_html = tpl.render(
+                    return tpl.render(
                         title=f"{st.session_state.project_title} {title_suffix}",
-                        date=datetime.now().strftime("%d %B %Y"),
+                        date=booklet_date,
                         students=s_list, matrix=m_list, medical_full=med_list,
                         no_perm_list=no_perm_list,
-                        options=display_opts, mode="full",
+                        options=display_opts, mode=mode, link_stubs=link_stubs,
                         student_count=len(s_list),
                         y8_camp_group=y8_camp_group,
                         camp_medications=camp_medications_for_subset,
                         camp_days=_camp_days,
                     )
-                    return HTML(string=full_html).write_pdf()
+
+                # Per-session cache of rendered student pages:
+                # profile_cache_key → (that student's own part, (0, page_count))
+                if 'profile_page_cache' not in st.session_state:
+                    st.session_state.profile_page_cache = OrderedDict()
+                profile_page_cache = st.session_state.profile_page_cache
+                cache_context = {
+                    "options": display_opts, "date": booklet_date,
+                    "template": hashlib.sha256(
+                        b"".join(open(os.path.join(TEMPLATE_DIR, f), "rb").read()
+                                 for f in ("profiles.html", "profiles.css"))
+                    ).hexdigest(),
+                }
+
+                def render_group_booklets(groups):
+                    """
+                    Two-tier render for every output mode. `groups` is a list of
+                    (label, records, title_suffix, y8_camp_group). Every student's
+                    profile + attachment pages are laid out ONCE, in blocks of
+                    render_shard_size students that render in parallel, and are
+                    reused from profile_page_cache when the student's inputs are
+                    unchanged; each group only lays out its own front matter.
+                    Yields (label, front, student_pages, link_ids) in group order,
+                    ready for append_booklet / compose_booklet.
+                    """
+                    union_recs, seen_ids = [], set()
+                    for _, recs, _, _ in groups:
+                        for rec in recs:
+                            if rec['profile']['link_id'] not in seen_ids:
+                                seen_ids.add(rec['profile']['link_id'])
+                                union_recs.append(rec)
+
+                    student_pages, to_render, cache_keys = {}, [], {}
+                    for rec in union_recs:
+                        link_id = rec['profile']['link_id']
+                        key = profile_cache_key(rec['profile'], image_registry, pdf_attachments, cache_context)
+                        cache_keys[link_id] = key
+                        if key in profile_page_cache:
+                            profile_page_cache.move_to_end(key)
+                            student_pages[link_id] = profile_page_cache[key]
+                        else:
+                            to_render.append(rec)
+                    if student_pages:
+                        status.write(f"♻️ Reusing pages for {len(student_pages)} unchanged student(s)")
+
+                    shard_size = max(1, int(render_shard_size))
+                    shards = [to_render[i:i + shard_size] for i in range(0, len(to_render), shard_size)]
+                    jobs = []
+                    for n, shard in enumerate(shards):
+                        label = "Student profiles" if len(shards) == 1 else \
+                            f"Student profiles {n * shard_size + 1}–{n * shard_size + len(shard)}"
+                        jobs.append((label,
+                                     build_subset_html(shard, mode="profiles", link_stubs=["photo-index"]),
+                                     ["photo-index"]))
+                    group_link_ids = []
+                    for label, recs, title_suffix, y8_camp_group in groups:
+                        link_ids = [rec['profile']['link_id'] for rec in recs]
+                        stubs = [f"student-{lid}" for lid in link_ids]
+                        group_link_ids.append(link_ids)
+                        jobs.append((label, build_subset_html(
+                            recs, title_suffix, y8_camp_group, mode="front", link_stubs=stubs
+                        ), stubs))
+
+                    _render_start = _time.time()
+                    results = render_parts(jobs, max_workers=render_workers,
+                                           images=image_registry, pdf_attachments=pdf_attachments)
+                    for n, (label, part, secs) in enumerate(results):
+                        status.write(f"✓ {label} — {secs:.1f}s")
+                        print(f"[Render] {label}: {part['page_count']} page(s) in {secs:.2f}s")
+                        if n < len(shards):
+                            # One small part per student, so the cache never
+                            # pins a whole block's PDF for a single student
+                            pieces = split_student_pages(part)
+                            for rec in shards[n]:
+                                link_id = rec['profile']['link_id']
+                                if link_id not in pieces:
+                                    continue
+                                piece = pieces[link_id]
+                                student_pages[link_id] = (piece, (0, piece['page_count']))
+                                profile_page_cache[cache_keys[link_id]] = student_pages[link_id]
+                            cache_bytes = sum(len(p['pdf']) for p, _ in profile_page_cache.values())
+                            while cache_bytes > PROFILE_CACHE_MAX_MB * 1024 * 1024 and profile_page_cache:
+                                _, (evicted, _) = profile_page_cache.popitem(last=False)
+                                cache_bytes -= len(evicted['pdf'])
+                            continue
+                        yield label, part, student_pages, group_link_ids[n - len(shards)]
+                    print(f"[Render] {len(to_render)} profile(s) in {len(shards)} block(s) "
+                          f"({len(union_recs) - len(to_render)} cached) + {len(groups)} group front(s) "
+                          f"in {_time.time() - _render_start:.2f}s "
+                          f"using {min(render_workers, len(jobs))} worker(s)")
 
                 if sort_by == "Custom Groups":
                     # Build a sid/email → record lookup from all_records
@@ -3755,35 +4108,38 @@ if t2 is not None:
                     elif "Separate" in output_mode:
                         _prog_placeholder.empty()
                         status.write("Generating separate PDFs…")
-                        zip_buffer = BytesIO()
-                        with zipfile.ZipFile(zip_buffer, "w") as zf:
-                            for grp in st.session_state.custom_groups:
-                                grp_recs = resolve_custom_group(grp['identifiers'])
-                                if not grp_recs:
-                                    continue
-                                pdf_data = render_subset(grp_recs, title_suffix=f"— {grp['label']}")
-                                safe_name = re.sub(r'[^a-zA-Z0-9]', '_', grp['label'])
-                                zf.writestr(f"Medical_Booklet_{safe_name}.pdf", pdf_data)
+                        groups = []
+                        for grp in st.session_state.custom_groups:
+                            grp_recs = resolve_custom_group(grp['identifiers'])
+                            if not grp_recs:
+                                continue
+                            groups.append((grp['label'], grp_recs, f"— {grp['label']}", None))
+                        out_path = new_output_path("Medical_Booklets_Groups.zip")
+                        with zipfile.ZipFile(out_path, "w") as zf:
+                            for label, front, student_pages, link_ids in render_group_booklets(groups):
+                                safe_name = re.sub(r'[^a-zA-Z0-9]', '_', label)
+                                zf.writestr(f"Medical_Booklet_{safe_name}.pdf",
+                                            compose_booklet(front, student_pages, link_ids))
                         status.update(label="✅ All group booklets ready", state="complete", expanded=False)
-                        st.download_button("⬇ Download Group Booklets (ZIP)", data=zip_buffer.getvalue(),
-                                           file_name="Medical_Booklets_Groups.zip", mime="application/zip")
+                        download_output("⬇ Download Group Booklets (ZIP)", out_path,
+                                        file_name="Medical_Booklets_Groups.zip", mime="application/zip")
                     else:
                         _prog_placeholder.empty()
                         status.write("Generating combined PDF…")
-                        writer = PdfWriter()
+                        groups = []
                         for grp in st.session_state.custom_groups:
                             grp_recs = resolve_custom_group(grp['identifiers'])
                             if not grp_recs:
                                 continue
-                            pdf_data = render_subset(grp_recs, title_suffix=f"— {grp['label']}")
-                            reader = PdfReader(BytesIO(pdf_data))
-                            for page in reader.pages:
-                                writer.add_page(page)
-                        combined_buf = BytesIO()
-                        writer.write(combined_buf)
+                            groups.append((grp['label'], grp_recs, f"— {grp['label']}", None))
+                        writer = PdfWriter()
+                        for _, front, student_pages, link_ids in render_group_booklets(groups):
+                            append_booklet(writer, front, student_pages, link_ids)
+                        out_path = new_output_path("Medical_Booklet_Combined_Groups.pdf")
+                        write_booklet(writer, out_path)
                         status.update(label="✅ Combined booklet ready", state="complete", expanded=False)
-                        st.download_button("⬇ Download Combined Booklet", data=combined_buf.getvalue(),
-                                           file_name="Medical_Booklet_Combined_Groups.pdf", mime="application/pdf")
+                        download_output("⬇ Download Combined Booklet", out_path,
+                                        file_name="Medical_Booklet_Combined_Groups.pdf", mime="application/pdf")
 
                 elif sort_by == "🏕️ Y8 Preloaded Camp Groups":
                     # Build groups keyed by "{Class} - {Camp}" e.g. "8A - Freycinet"
@@ -3803,35 +4159,38 @@ if t2 is not None:
                     elif "12 Separate" in output_mode:
                         _prog_placeholder.empty()
                         status.write("Generating separate camp PDFs…")
-                        zip_buffer = BytesIO()
-                        with zipfile.ZipFile(zip_buffer, "w") as zf:
-                            for g_name in sorted(y8_groups.keys()):
-                                g_recs = y8_groups[g_name]
-                                _camp = g_recs[0]['profile']['y8_camp']['camp']
-                                pdf_data = render_subset(g_recs, title_suffix=f"— {g_name}", y8_camp_group=_camp)
+                        groups = []
+                        for g_name in sorted(y8_groups.keys()):
+                            g_recs = y8_groups[g_name]
+                            _camp = g_recs[0]['profile']['y8_camp']['camp']
+                            groups.append((g_name, g_recs, f"— {g_name}", _camp))
+                        out_path = new_output_path("Y8_Camp_Medical_Booklets.zip")
+                        with zipfile.ZipFile(out_path, "w") as zf:
+                            for g_name, front, student_pages, link_ids in render_group_booklets(groups):
                                 safe_name = re.sub(r'[^a-zA-Z0-9]', '_', g_name)
-                                zf.writestr(f"Medical_Booklet_{safe_name}.pdf", pdf_data)
+                                zf.writestr(f"Medical_Booklet_{safe_name}.pdf",
+                                            compose_booklet(front, student_pages, link_ids))
                         status.update(label="✅ All camp booklets ready", state="complete", expanded=False)
-                        st.download_button(
-                            "⬇ Download Camp Booklets (ZIP)", data=zip_buffer.getvalue(),
+                        download_output(
+                            "⬇ Download Camp Booklets (ZIP)", out_path,
                             file_name="Y8_Camp_Medical_Booklets.zip", mime="application/zip"
                         )
                     else:
                         _prog_placeholder.empty()
                         status.write("Generating master camp PDF…")
-                        writer = PdfWriter()
+                        groups = []
                         for g_name in sorted(y8_groups.keys()):
                             g_recs = y8_groups[g_name]
                             _camp = g_recs[0]['profile']['y8_camp']['camp']
-                            pdf_data = render_subset(g_recs, title_suffix=f"— {g_name}", y8_camp_group=_camp)
-                            reader = PdfReader(BytesIO(pdf_data))
-                            for page in reader.pages:
-                                writer.add_page(page)
-                        combined_buf = BytesIO()
-                        writer.write(combined_buf)
+                            groups.append((g_name, g_recs, f"— {g_name}", _camp))
+                        writer = PdfWriter()
+                        for _, front, student_pages, link_ids in render_group_booklets(groups):
+                            append_booklet(writer, front, student_pages, link_ids)
+                        out_path = new_output_path("Y8_Camp_Medical_Booklet_Master.pdf")
+                        write_booklet(writer, out_path)
                         status.update(label="✅ Master camp booklet ready", state="complete", expanded=False)
-                        st.download_button(
-                            "⬇ Download Master Camp Booklet", data=combined_buf.getvalue(),
+                        download_output(
+                            "⬇ Download Master Camp Booklet", out_path,
                             file_name="Y8_Camp_Medical_Booklet_Master.pdf", mime="application/pdf"
                         )
 
@@ -3852,28 +4211,38 @@ if t2 is not None:
                     if "Split" in output_mode:
                         _prog_placeholder.empty()
                         status.write("Generating split PDFs…")
-                        zip_buffer = BytesIO()
                         groups = {}
                         for r in all_records:
                             k = r['sort_keys'][group_key]
                             if not k: k = "Unknown"
                             if k not in groups: groups[k] = []
                             groups[k].append(r)
-                        with zipfile.ZipFile(zip_buffer, "w") as zf:
-                            for g_name, g_records in groups.items():
-                                safe_name = re.sub(r'[^a-zA-Z0-9]', '_', str(g_name))
-                                pdf_data = render_subset(g_records, title_suffix=f"— {g_name}")
-                                zf.writestr(f"Medical_Booklet_{safe_name}.pdf", pdf_data)
+                        groups = [
+                            (str(g_name), g_records, f"— {g_name}", None)
+                            for g_name, g_records in groups.items()
+                        ]
+                        out_path = new_output_path("Medical_Booklets.zip")
+                        with zipfile.ZipFile(out_path, "w") as zf:
+                            for g_name, front, student_pages, link_ids in render_group_booklets(groups):
+                                safe_name = re.sub(r'[^a-zA-Z0-9]', '_', g_name)
+                                zf.writestr(f"Medical_Booklet_{safe_name}.pdf",
+                                            compose_booklet(front, student_pages, link_ids))
                         status.update(label="✅ All files generated", state="complete", expanded=False)
-                        st.download_button("⬇ Download ZIP", data=zip_buffer.getvalue(),
-                                           file_name="Medical_Booklets.zip", mime="application/zip")
+                        download_output("⬇ Download ZIP", out_path,
+                                        file_name="Medical_Booklets.zip", mime="application/zip")
                     else:
                         _prog_placeholder.empty()
                         status.write("Generating PDF…")
-                        pdf_data = render_subset(all_records)
+                        # Profiles are laid out in parallel blocks (or reused from the
+                        # page cache); photo grid / matrix links are re-pointed on merge
+                        out_path = new_output_path("Medical_Booklet.pdf")
+                        for _, front, student_pages, link_ids in render_group_booklets(
+                            [("Front matter", all_records, "", None)]
+                        ):
+                            compose_booklet(front, student_pages, link_ids, target=out_path)
                         status.update(label="✅ Booklet ready", state="complete", expanded=False)
-                        st.download_button("⬇ Download Medical Booklet", data=pdf_data,
-                                           file_name="Medical_Booklet.pdf", mime="application/pdf")
+                        download_output("⬇ Download Medical Booklet", out_path,
+                                        file_name="Medical_Booklet.pdf", mime="application/pdf")
 
 # ═══════════════════════════════════════════════════════════════════════════════
 # TAB 3 — SEQTA GROUP CREATOR
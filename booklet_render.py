@@ -0,0 +1,435 @@
+"""
+Booklet PDF rendering that runs outside the Streamlit script.
+
+Streamlit executes app.py top-to-bottom on every rerun, so anything handed
+to a worker process has to live in a plain importable module with no UI
+side effects. app.py builds the HTML for each part of a booklet and passes
+it here; this module lays it out with WeasyPrint (optionally across a
+process pool) and stitches the parts back together with pypdf.
+
+A booklet is made of two kinds of part:
+  - "profiles" parts — blocks (shards) of students' profile + attachment
+    pages, each student laid out once no matter how many groups they are in
+  - a "front" part per group — cover, photo grid, camp medication log,
+    Y8 summary, dietary table, photo permissions, matrix and summary
+Links between parts (photo grid → profile, profile → photo grid) are kept
+alive by stub anchors in the template and re-pointed after merging.
+"""
+import os
+import time
+import multiprocessing
+from io import BytesIO
+from concurrent.futures import ProcessPoolExecutor
+
+from weasyprint import HTML, CSS, default_url_fetcher
+from weasyprint.text.fonts import FontConfiguration
+from pypdf import PdfWriter, PdfReader
+from pypdf.generic import (
+    ArrayObject, DictionaryObject, FloatObject, IndirectObject, NameObject,
+    NumberObject, ByteStringObject,
+)
+
+# CSS px → PDF points (WeasyPrint lays out at 96 px per inch, PDF uses 72)
+_PX_TO_PT = 0.75
+
+# Static booklet styles; the template only inlines the per-size :root variables
+STYLESHEET_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                               "templates", "profiles.css")
+
+# Parsed stylesheet + font configuration, built on first use and then shared
+# by every render in this process (the app process, or one pool worker), so
+# the CSS is parsed and fontconfig is queried once rather than per group.
+_STYLESHEETS = None
+_FONT_CONFIG = None
+
+
+def _shared_style():
+    """Returns (stylesheets, font_config) for this process, creating them once."""
+    global _STYLESHEETS, _FONT_CONFIG
+    if _STYLESHEETS is None:
+        _FONT_CONFIG = FontConfiguration()
+        _STYLESHEETS = [CSS(filename=STYLESHEET_PATH, font_config=_FONT_CONFIG)]
+    return _STYLESHEETS, _FONT_CONFIG
+
+
+# Images referenced by the booklet HTML as img://… URLs, keyed by URL, and
+# attachment PDFs spliced in as native pages, keyed by their marker anchor id.
+# Filled per render by _init_assets — in-process, or once per worker through
+# the pool initializer so the bytes are shipped to each worker once rather
+# than with every job.
+_IMAGE_REGISTRY = {}
+_PDF_ATTACHMENTS = {}
+
+
+def _init_assets(images, pdf_attachments=None):
+    global _IMAGE_REGISTRY, _PDF_ATTACHMENTS
+    _IMAGE_REGISTRY = images or {}
+    _PDF_ATTACHMENTS = pdf_attachments or {}
+
+
+def _sniff_image_mime(data):
+    if data[:8] == b"\x89PNG\r\n\x1a\n":
+        return "image/png"
+    return "image/jpeg"
+
+
+def image_url_fetcher(url):
+    """
+    WeasyPrint url_fetcher serving img://… URLs from the image registry.
+    WeasyPrint caches fetched images by URL, so a photo used on the grid,
+    the profile page and the no-permission list is decoded once and
+    embedded in the PDF once. Anything else goes to the default fetcher.
+    """
+    if url.startswith("img://"):
+        data = _IMAGE_REGISTRY.get(url)
+        if data is None:
+            raise ValueError(f"Image not registered: {url}")
+        return {"string": data, "mime_type": _sniff_image_mime(data), "redirected_url": url}
+    return default_url_fetcher(url)
+
+
+def default_render_workers():
+    """Sensible default pool size — leave one core free for the app itself."""
+    return max(1, min(4, (os.cpu_count() or 1) - 1))
+
+
+def _splice_pdf_attachments(pdf_bytes, anchors, page_count):
+    """
+    Inserts attachment PDFs as native pages straight after the page holding
+    their marker anchor (see `.attach-marker` in the template), in document
+    order, and shifts every other anchor to match.
+    Returns (pdf_bytes, anchors, page_count).
+
+    The rendered file is cloned rather than rebuilt page by page so its
+    named destinations — and therefore WeasyPrint's internal links — stay
+    valid for standalone output.
+    """
+    markers = [(page_index, name) for name, (page_index, _, _) in anchors.items()
+               if name in _PDF_ATTACHMENTS]
+    if not markers:
+        return pdf_bytes, anchors, page_count
+
+    writer = PdfWriter(clone_from=PdfReader(BytesIO(pdf_bytes)))
+    inserted_after = {}     # original page index → pages inserted after it
+    total_inserted = 0
+    # sorted() is stable, so markers sharing a page keep document order
+    for page_index, name in sorted(markers, key=lambda m: m[0]):
+        try:
+            attachment = PdfReader(BytesIO(_PDF_ATTACHMENTS[name]))
+            position = page_index + 1 + total_inserted
+            for n, page in enumerate(attachment.pages):
+                writer.insert_page(page, position + n)
+            added = len(attachment.pages)
+        except Exception as e:
+            print(f"[Attach] Could not splice {name}: {e}")
+            continue
+        inserted_after[page_index] = inserted_after.get(page_index, 0) + added
+        total_inserted += added
+
+    def _shift(page_index):
+        return page_index + sum(n for p, n in inserted_after.items() if p < page_index)
+
+    spliced_anchors = {
+        name: (_shift(page_index), left, top)
+        for name, (page_index, left, top) in anchors.items()
+        if name not in _PDF_ATTACHMENTS
+    }
+    buf = BytesIO()
+    writer.write(buf)
+    return buf.getvalue(), spliced_anchors, page_count + total_inserted
+
+
+def render_part(html, link_stubs=None):
+    """
+    Lays out one HTML document, writes it to PDF and splices in any native
+    attachment pages. Returns a part:
+        { "pdf": bytes, "page_count": int,
+          "anchors": { name: (page_index, left_pt, top_pt) } }
+    Anchors listed in link_stubs are placeholders for targets that live in
+    another part, so they are left out of the part's own anchor table.
+    """
+    stubs = set(link_stubs or ())
+    stylesheets, font_config = _shared_style()
+    document = HTML(string=html, url_fetcher=image_url_fetcher).render(
+        stylesheets=stylesheets, font_config=font_config
+    )
+    anchors = {}
+    for page_index, page in enumerate(document.pages):
+        for name, (x, y) in page.anchors.items():
+            if name in stubs or name in anchors:
+                continue
+            anchors[name] = (page_index, x * _PX_TO_PT, (page.height - y) * _PX_TO_PT)
+
+    pdf_bytes, anchors, page_count = _splice_pdf_attachments(
+        document.write_pdf(), anchors, len(document.pages)
+    )
+    return {"pdf": pdf_bytes, "page_count": page_count, "anchors": anchors}
+
+
+def render_part_job(job):
+    """Worker entry point: (label, html, link_stubs) → (label, part, seconds)."""
+    label, html, link_stubs = job
+    start = time.perf_counter()
+    part = render_part(html, link_stubs)
+    return label, part, time.perf_counter() - start
+
+
+def render_parts(jobs, max_workers=1, images=None, pdf_attachments=None):
+    """
+    Renders a list of (label, html, link_stubs) jobs and yields
+    (label, part, seconds) in the SAME order as `jobs`, regardless of which
+    worker finishes first — callers compose booklets straight into a ZIP or
+    PdfWriter and rely on that order.
+
+    `images` maps the img://… URLs used in the HTML to their bytes and
+    `pdf_attachments` maps attachment marker ids to PDF bytes.
+    max_workers <= 1 (or a single job) renders in-process with no pool.
+    The pool uses the 'spawn' start method: forking the multi-threaded
+    Streamlit server is not safe, and macOS defaults to spawn anyway.
+    """
+    jobs = list(jobs)
+    if not jobs:
+        return
+    n_workers = max(1, min(int(max_workers or 1), len(jobs)))
+    if n_workers == 1:
+        _init_assets(images, pdf_attachments)
+        try:
+            for job in jobs:
+                yield render_part_job(job)
+        finally:
+            # Don't keep a whole run's photos alive between Streamlit reruns
+            _init_assets(None)
+        return
+
+    ctx = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=n_workers, mp_context=ctx,
+                             initializer=_init_assets, initargs=(images, pdf_attachments)) as pool:
+        # map() preserves input order; results for later groups simply wait
+        # until every earlier job has been yielded.
+        for result in pool.map(render_part_job, jobs):
+            yield result
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# COMPOSITION
+# ─────────────────────────────────────────────────────────────────────────────
+
+def student_page_ranges(part):
+    """
+    Returns { link_id: (start, stop) } page ranges for a profiles part.
+    A student's range runs from their `student-<link_id>` anchor up to the
+    next student's anchor, so attachment pages stay with their profile.
+    """
+    starts = sorted(
+        (page_index, name[len("student-"):])
+        for name, (page_index, _, _) in part["anchors"].items()
+        if name.startswith("student-")
+    )
+    ranges = {}
+    for n, (start, link_id) in enumerate(starts):
+        stop = starts[n + 1][0] if n + 1 < len(starts) else part["page_count"]
+        ranges[link_id] = (start, stop)
+    return ranges
+
+
+def split_student_pages(part):
+    """
+    Cuts a profiles part into one small part per student, keyed by link_id,
+    each holding just that student's pages and anchors. Cached students then
+    keep only their own pages alive, not the whole block they were rendered
+    in. Link annotations keep their named targets, so resolve_internal_links
+    still re-points them after composing.
+    """
+    reader = PdfReader(BytesIO(part["pdf"]))
+    pieces = {}
+    for link_id, (start, stop) in student_page_ranges(part).items():
+        writer = PdfWriter()
+        for page_index in range(start, stop):
+            writer.add_page(reader.pages[page_index])
+        buf = BytesIO()
+        writer.write(buf)
+        pieces[link_id] = {
+            "pdf": buf.getvalue(),
+            "page_count": stop - start,
+            "anchors": {name: (page_index - start, left, top)
+                        for name, (page_index, left, top) in part["anchors"].items()
+                        if start <= page_index < stop},
+        }
+    return pieces
+
+
+def _append_pages(writer, part, page_indices, dests):
+    """
+    Copies the given pages of a part into writer and records where each of
+    the part's anchors landed. Returns nothing; `dests` is updated in place.
+
+    A fresh PdfReader is opened per call: pypdf remembers which source
+    objects it has already cloned, so re-adding a page from a shared reader
+    (a student in two groups of one combined booklet) would alias the first
+    copy instead of duplicating it.
+    """
+    reader = PdfReader(BytesIO(part["pdf"]))
+    placed = {}
+    for page_index in page_indices:
+        placed[page_index] = len(writer.pages)
+        writer.add_page(reader.pages[page_index])
+    for name, (page_index, left, top) in part["anchors"].items():
+        if page_index in placed and name not in dests:
+            dests[name] = (placed[page_index], left, top)
+
+
+def _link_target_name(annot):
+    """Returns the named destination of a link annotation, or None."""
+    dest = annot.get("/Dest")
+    if dest is None and "/A" in annot:
+        action = annot["/A"].get_object()
+        if action.get("/S") == "/GoTo":
+            dest = action.get("/D")
+    if isinstance(dest, ByteStringObject):
+        return dest.decode("latin-1")
+    if isinstance(dest, str):
+        return dest
+    return None
+
+
+def resolve_internal_links(writer, dests, first_page=0):
+    """
+    Re-points named internal links on writer.pages[first_page:] to explicit
+    page destinations. `dests` maps anchor name → (page_index, left, top).
+    WeasyPrint writes internal links as named destinations, but the merged
+    file has no name tree of its own — explicit destinations also survive
+    any later merge untouched.
+    """
+    for page in writer.pages[first_page:]:
+        for annot_ref in page.get("/Annots", None) or []:
+            annot = annot_ref.get_object()
+            if annot.get("/Subtype") != "/Link":
+                continue
+            name = _link_target_name(annot)
+            if name is None or name not in dests:
+                continue
+            page_index, left, top = dests[name]
+            annot[NameObject("/Dest")] = ArrayObject([
+                writer.pages[page_index].indirect_reference,
+                NameObject("/XYZ"), FloatObject(left), FloatObject(top), NumberObject(0),
+            ])
+            if "/A" in annot:
+                del annot["/A"]
+
+
+def deduplicate_resources(writer):
+    """
+    Merges identical resource objects — image XObjects (and their soft
+    masks), fonts and font files, content streams — so each is written once.
+    A booklet is stitched together from separately rendered parts, so the
+    same photo arrives from the front part and the profiles part, and in a
+    combined booklet a student's pages or a shared plan arrive once per group.
+    Photos merge because app.py gives the photo grid and the profile page the
+    same rendition bytes and WeasyPrint embeds JPEGs unchanged, so both parts
+    carry identical image streams; differently encoded copies never would.
+
+    Only what hangs off page /Resources and /Contents is touched; pages and
+    link annotations stay distinct objects. Orphaned copies are dropped.
+    Returns the number of references re-pointed.
+    """
+    canonical = {}   # hash_value → first IndirectObject with that content
+    resolved = {}    # idnum → canonical IndirectObject
+    merged = 0
+
+    def canon(ref):
+        nonlocal merged
+        if ref.idnum in resolved:
+            return resolved[ref.idnum]
+        resolved[ref.idnum] = ref   # guards against reference cycles
+        obj = ref.get_object()
+        canon_children(obj)
+        result = canonical.setdefault(obj.hash_value(), ref)
+        resolved[ref.idnum] = result
+        if result is not ref:
+            merged += 1
+        return result
+
+    def canon_children(obj):
+        if isinstance(obj, DictionaryObject):   # includes streams
+            items = list(obj.items())
+        elif isinstance(obj, ArrayObject):
+            items = list(enumerate(obj))
+        else:
+            return
+        for key, value in items:
+            if key in ("/Parent", "/P"):
+                continue
+            if isinstance(value, IndirectObject):
+                obj[key] = canon(value)
+            else:
+                canon_children(value)
+
+    for page in writer.pages:
+        for key in ("/Resources", "/Contents"):
+            if key not in page:
+                continue
+            value = page.raw_get(key)
+            if isinstance(value, IndirectObject):
+                page[NameObject(key)] = canon(value)
+            else:
+                canon_children(value)
+
+    if merged:
+        writer.compress_identical_objects(remove_duplicates=False, remove_unreferenced=True)
+    return merged
+
+
+def write_booklet(writer, target):
+    """Deduplicates shared resources and writes writer to a path or binary file."""
+    start = time.perf_counter()
+    merged = deduplicate_resources(writer)
+    print(f"[Merge] {merged} duplicate object(s) merged in {time.perf_counter() - start:.2f}s")
+    writer.write(target)
+
+
+def append_booklet(writer, front, student_pages, link_ids):
+    """
+    Appends one group booklet to writer: the group's front part, then each
+    listed student's pages (in link_ids order), then the trailing blank page
+    the full template ends with. Links that cross parts are re-pointed
+    afterwards.
+
+    student_pages maps link_id → (part, (start, stop)) — normally the
+    student's own piece from split_student_pages(), rendered this run or
+    cached from an earlier Generate.
+    """
+    first_page = len(writer.pages)
+    dests = {}
+    _append_pages(writer, front, range(front["page_count"]), dests)
+
+    # Copy consecutive students from the same part in one pass
+    run_part, run_pages = None, []
+    for link_id in link_ids:
+        if link_id not in student_pages:
+            continue
+        part, page_range = student_pages[link_id]
+        if part is not run_part and run_pages:
+            _append_pages(writer, run_part, run_pages, dests)
+            run_pages = []
+        run_part = part
+        run_pages.extend(range(*page_range))
+    if run_pages:
+        _append_pages(writer, run_part, run_pages, dests)
+
+    writer.add_blank_page()
+    resolve_internal_links(writer, dests, first_page)
+
+
+def compose_booklet(front, student_pages, link_ids, target=None):
+    """
+    Builds a standalone group booklet. Writes it to `target` (a path or
+    binary file) when given, otherwise returns its PDF bytes.
+    """
+    writer = PdfWriter()
+    append_booklet(writer, front, student_pages, link_ids)
+    if target is not None:
+        write_booklet(writer, target)
+        return None
+    buf = BytesIO()
+    write_booklet(writer, buf)
+    return buf.getvalue()
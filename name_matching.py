@@ -0,0 +1,182 @@
+"""
+Name matching shared by the Paperly form matchers in app.py.
+
+The roster is compiled once per Process run into a list of students with
+their lowercased names, word tokens and whole-word patterns; form rows are
+then assigned to students through an inverted token index. Records that
+still don't match get fuzzy suggestions from a trigram index over the same
+roster. Plain functions with no Streamlit dependency, so they can be used
+and tested on their own.
+"""
+import re
+
+
+NAME_TOKEN_RE = re.compile(r'\w+')
+
+
+def whole_word(text):
+    """Compiled pattern matching text as a whole word."""
+    return re.compile(r'\b' + re.escape(text) + r'\b')
+
+
+def build_roster_name_index(df_main, cols):
+    """
+    Compiles the roster once for the Paperly form matchers. Returns a list of
+    students in roster order, each with their lowercased names, the surname's
+    word tokens, precompiled whole-word patterns and whether the surname is
+    shared (the duplicate-surname rule needs a first/preferred name too).
+    """
+    students = []
+    surname_counts = {}
+    for _, row in df_main.iterrows():
+        surname = str(row[cols['surname']]).strip()
+        if not surname:
+            continue
+        first_name     = str(row[cols['first_name']]).strip()
+        preferred_name = str(row.get('Preferred name', '')).strip()
+        surname_lower  = surname.lower()
+        surname_counts[surname_lower] = surname_counts.get(surname_lower, 0) + 1
+        students.append({
+            'id':             str(row[cols['student_id']]),
+            'first_name':     first_name,
+            'preferred_name': preferred_name,
+            'surname':        surname,
+            'surname_tokens': NAME_TOKEN_RE.findall(surname_lower),
+            'surname_pat':    whole_word(surname_lower),
+            'first_pat':      whole_word(first_name.lower()) if first_name else None,
+            'pref_pat':       whole_word(preferred_name.lower()) if preferred_name else None,
+            'surname_lower':  surname_lower,
+        })
+    for student in students:
+        student['has_dup'] = surname_counts[student['surname_lower']] > 1
+    return students
+
+
+def match_names_to_roster(roster_index, texts, usable=None):
+    """
+    Assigns form rows (texts = lowercased Student field per row) to students.
+    Each student, in roster order, takes the first unused usable row whose
+    text contains their surname as a whole word — plus their first or
+    preferred name when the surname is shared.
+
+    Candidate rows come from an inverted token index over the texts: a
+    whole-word surname match implies every word token of the surname is a
+    token of the row, so only rows holding all of them are regex-checked.
+    Returns {student_id: row position}.
+    """
+    postings = {}
+    for pos, text in enumerate(texts):
+        for token in set(NAME_TOKEN_RE.findall(text)):
+            postings.setdefault(token, set()).add(pos)
+    all_rows = set(range(len(texts)))
+
+    matched, used = {}, set()
+    for student in roster_index:
+        tokens = student['surname_tokens']
+        if tokens:
+            candidates = set.intersection(*(postings.get(t, set()) for t in tokens))
+        else:
+            candidates = all_rows
+        for pos in sorted(candidates - used):
+            if usable is not None and not usable[pos]:
+                continue
+            text = texts[pos]
+            if not student['surname_pat'].search(text):
+                continue
+            if student['has_dup'] and not (
+                (student['first_pat'] and student['first_pat'].search(text)) or
+                (student['pref_pat'] and student['pref_pat'].search(text))
+            ):
+                continue
+            matched[student['id']] = pos
+            used.add(pos)
+            break
+    return matched
+
+
+# ---------------------------------------------------------------------------
+# Fuzzy suggestions.
+# For records the exact matchers missed (typos, nicknames, hyphenation).
+# Scores are trigram Dice similarity, 0–1. Suggestions at or above
+# FUZZY_SUGGEST_MIN are offered; the best is auto-accepted when it reaches
+# the caller's threshold and beats the runner-up by FUZZY_AUTO_MARGIN.
+# ---------------------------------------------------------------------------
+FUZZY_SUGGEST_MIN = 0.45
+FUZZY_AUTO_ACCEPT = 0.85
+FUZZY_AUTO_MARGIN = 0.10
+FUZZY_TOP_K       = 3
+
+
+def _name_trigrams(text):
+    """Word-padded character trigrams of a name; digits-only words are ignored."""
+    grams = set()
+    for token in NAME_TOKEN_RE.findall(str(text).lower()):
+        if token.isdigit():
+            continue
+        padded = f" {token} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+def build_fuzzy_name_index(roster_index):
+    """
+    Trigram index over roster names (first + surname, and preferred +
+    surname), built once per roster: { "variants": [(sid, n_grams)],
+    "postings": {trigram: [variant, …]} }.
+    """
+    variants, postings = [], {}
+    for student in roster_index:
+        names = {f"{student['first_name']} {student['surname']}"}
+        if student['preferred_name']:
+            names.add(f"{student['preferred_name']} {student['surname']}")
+        for name in names:
+            grams = _name_trigrams(name)
+            if not grams:
+                continue
+            for gram in grams:
+                postings.setdefault(gram, []).append(len(variants))
+            variants.append((student['id'], len(grams)))
+    return {"variants": variants, "postings": postings}
+
+
+def fuzzy_name_candidates(fuzzy_index, text, k=FUZZY_TOP_K):
+    """Top-k [(sid, score)] for a free-text name, best first; scores are trigram Dice."""
+    query = _name_trigrams(text)
+    if not query:
+        return []
+    shared = {}
+    for gram in query:
+        for v in fuzzy_index["postings"].get(gram, ()):
+            shared[v] = shared.get(v, 0) + 1
+    best = {}
+    for v, n_shared in shared.items():
+        sid, n_grams = fuzzy_index["variants"][v]
+        score = 2 * n_shared / (len(query) + n_grams)
+        if score > best.get(sid, 0):
+            best[sid] = score
+    return sorted(best.items(), key=lambda kv: (-kv[1], kv[0]))[:k]
+
+
+def suggest_roster_matches(fuzzy_index, items, text_of, key_of, taken=(),
+                           auto_accept=FUZZY_AUTO_ACCEPT):
+    """
+    Adds item['suggestions'] = [(sid, score), …] to each unmatched record and
+    returns {item key: sid} for the confident ones — best score at least
+    auto_accept and FUZZY_AUTO_MARGIN clear of the runner-up — skipping
+    students already matched (taken) or auto-accepted for another record.
+    """
+    accepted, used = {}, set(taken)
+    for item in items:
+        cands = [c for c in fuzzy_name_candidates(fuzzy_index, text_of(item))
+                 if c[1] >= FUZZY_SUGGEST_MIN]
+        item['suggestions'] = [(sid, round(score, 2)) for sid, score in cands]
+        if not cands:
+            continue
+        sid, score = cands[0]
+        runner_up = cands[1][1] if len(cands) > 1 else 0
+        if score >= auto_accept and score - runner_up >= FUZZY_AUTO_MARGIN and sid not in used:
+            accepted[key_of(item)] = sid
+            used.add(sid)
+    if accepted:
+        print(f"[Fuzzy] Auto-accepted {len(accepted)} of {len(items)} unmatched record(s)")
+    return accepted
@@ -0,0 +1,863 @@
+"""
+Photo-PDF scanning that runs outside the Streamlit script.
+
+Matches surname labels on each page of a school photo PDF to the student
+roster and saves the photo above each match. Pages are independent — the
+matcher only needs the read-only surname map — so app.py can spread them
+across a process pool; like booklet_render.py, this module has no UI side
+effects so it can be imported by spawned workers.
+"""
+import os
+import re
+import uuid
+import json
+import bisect
+import hashlib
+import multiprocessing
+from io import BytesIO
+from concurrent.futures import ProcessPoolExecutor
+
+import pdfplumber
+from pdfminer.pdftypes import PDFStream, resolve1
+from PIL import Image
+
+
+# ---------------------------------------------------------------------------
+# Ligature / unknown-glyph map.
+# The FB-block entries are standard Unicode ligatures.
+# The LIGATURE_MAP at module level is checked first; then any char
+# in the PUA range (E000-F8FF) that is NOT in the map is treated as
+# "tt" as a fallback (the most common unmapped school-photo glyph).
+# ---------------------------------------------------------------------------
+LIGATURE_MAP = {
+    "\ufb00": "ff",
+    "\ufb01": "fi",
+    "\ufb02": "fl",
+    "\ufb03": "ffi",
+    "\ufb04": "ffl",
+    "\ufb05": "st",
+    "\ufb06": "st",
+}
+
+# Accumulates any PUA chars we actually encounter, for the debug log.
+_SEEN_PUA_CHARS = set()
+
+# clean_ligatures() rules 1–3 compiled into one str.translate() table: LIGATURE_MAP
+# wins, every other PUA char becomes "tt", zero-width chars are dropped.
+_PUA_RANGE = range(0xE000, 0xF8FF + 1)
+_ZERO_WIDTH = (0x200B, 0x200C, 0x200D, 0xFEFF)
+_GLYPH_TABLE = {cp: "tt" for cp in _PUA_RANGE}
+_GLYPH_TABLE.update({cp: None for cp in _ZERO_WIDTH})
+_GLYPH_TABLE.update({ord(ch): rep for ch, rep in LIGATURE_MAP.items()})
+_PUA_RE = re.compile("[\ue000-\uf8ff]")
+_TRIPLE_RUN_RE = re.compile(r'(.)\1{2,}')
+
+
+def clean_ligatures(text):
+    """
+    Centralised ligature / glyph cleanup.
+    1. Known ligatures (FB block) are replaced by their expansions.
+    2. ANY Private-Use-Area character (U+E000–U+F8FF) not already in
+       LIGATURE_MAP is assumed to be 'tt' (by far the most common
+       unmapped glyph in school-photo PDFs) and replaced accordingly.
+       The char is also logged to _SEEN_PUA_CHARS for the debug dump.
+    3. Zero-width / invisible formatting chars are stripped.
+    4. Any run of 3+ identical letters is collapsed to exactly 2.
+       This handles pdfplumber emitting phantom duplicate chars after
+       a ligature glyph (e.g. [PUA]+"tt" -> "tttt" collapses to "tt").
+       No English surname has 3+ of the same letter in a row.
+    """
+    for ch in _PUA_RE.findall(text):
+        if ch not in LIGATURE_MAP:
+            _SEEN_PUA_CHARS.add(ch)
+    return _TRIPLE_RUN_RE.sub(r'\1\1', text.translate(_GLYPH_TABLE))
+
+
+def debug_dump_pua_chars(chars=None):
+    """
+    Call after scanning to see every PUA char that was hit. Pass the merged
+    set when pages were scanned in worker processes.
+    """
+    chars = _SEEN_PUA_CHARS if chars is None else chars
+    if chars:
+        print("=== PUA chars encountered (all mapped to 'tt') ===")
+        for ch in sorted(chars, key=ord):
+            print(f"  U+{ord(ch):04X}  repr={repr(ch)}")
+    else:
+        print("=== No PUA chars encountered ===")
+
+
+def debug_find_ligature_char(photo_pdf_path, target_fragment="ma"):
+    """
+    Scans every word in the PDF and prints repr() for any word
+    containing target_fragment (case-insensitive, after lowering).
+    Example: target_fragment="ma" will catch "Matthew", "Mattie", etc.
+    """
+    import pdfplumber
+    with pdfplumber.open(photo_pdf_path) as pdf:
+        for page_num, page in enumerate(pdf.pages):
+            for w in page.extract_words():
+                if target_fragment in w['text'].lower():
+                    print(f"  Page {page_num+1} | raw repr: {repr(w['text'])} | "
+                          f"codepoints: {[f'U+{ord(c):04X}' for c in w['text']]}")
+# ---------------------------------------------------------------------------
+
+
+# ---------------------------------------------------------------------------
+# Word table.
+# Each page's extract_words() output is normalised once into parallel
+# columns, so the matcher, lookahead and orphan passes index plain lists
+# instead of re-cleaning the same words over and over.
+# ---------------------------------------------------------------------------
+def build_word_table(words):
+    """
+    Returns {"raw", "text", "key", "x0", "x1", "top", "bottom", "cx"}, one list
+    per column, row i describing words[i]. raw is ligature-cleaned text as
+    printed, text the same lowercased, key the surname-matching key.
+    """
+    raw  = [clean_ligatures(w['text']) for w in words]
+    text = [clean_ligatures(w['text'].lower()) for w in words]
+    x0   = [w['x0'] for w in words]
+    x1   = [w['x1'] for w in words]
+    return {
+        "raw":    raw,
+        "text":   text,
+        "key":    [t.translate(_PHRASE_PUNCT) for t in text],
+        "x0":     x0,
+        "x1":     x1,
+        "top":    [w['top'] for w in words],
+        "bottom": [w['bottom'] for w in words],
+        "cx":     [(a + b) / 2 for a, b in zip(x0, x1)],
+    }
+# ---------------------------------------------------------------------------
+
+
+# ---------------------------------------------------------------------------
+# Word spatial index.
+# Uniform grid over a page's word boxes: each word is bucketed by the row of
+# its `top` and every column its x-range spans. A box query only visits the
+# buckets it overlaps, so the lookahead / orphan-text searches touch nearby
+# words instead of scanning the whole page for every match.
+# ---------------------------------------------------------------------------
+WORD_GRID_CELL = 40   # points
+
+
+def build_word_grid(table, cell=WORD_GRID_CELL):
+    """Returns {(row, col): [word index, …]} for a page's build_word_table()."""
+    grid = {}
+    for idx, (top, x0, x1) in enumerate(zip(table["top"], table["x0"], table["x1"])):
+        row = int(top // cell)
+        for col in range(int(x0 // cell), int(x1 // cell) + 1):
+            grid.setdefault((row, col), []).append(idx)
+    return grid
+
+
+def words_near(grid, top_min, top_max, x_min, x_max, cell=WORD_GRID_CELL):
+    """
+    Indices (in reading order) of words whose bucket overlaps the box
+    top_min..top_max × x_min..x_max. A superset — callers still apply their
+    exact bounds test.
+    """
+    found = set()
+    for row in range(int(top_min // cell), int(top_max // cell) + 1):
+        for col in range(int(x_min // cell), int(x_max // cell) + 1):
+            found.update(grid.get((row, col), ()))
+    return sorted(found)
+# ---------------------------------------------------------------------------
+
+
+# ---------------------------------------------------------------------------
+# Surname phrase matcher.
+# Student surname keys are compiled once into a character trie. Walking it
+# word by word from a start position yields every surname that the next
+# 1–5 words spell out, in a single left-to-right pass, instead of joining
+# and re-cleaning the text for each phrase length.
+# ---------------------------------------------------------------------------
+MAX_SURNAME_WORDS = 5
+_PHRASE_PUNCT = str.maketrans("", "", ",:.-'")
+
+
+def build_surname_trie(keys):
+    """Character trie over surname keys; a node's "" entry holds the full key."""
+    root = {}
+    for key in keys:
+        node = root
+        for ch in key:
+            node = node.setdefault(ch, {})
+        node[""] = key
+    return root
+
+
+def surname_matches(trie, word_keys, start, max_words=MAX_SURNAME_WORDS):
+    """
+    Returns [(n_words, surname_key), …] for every surname spelt by the words
+    from `start`, longest phrase first.
+
+    Surname keys were put through clean_ligatures() as one joined string, so
+    a run of 3+ letters is collapsed across word gaps here too ("Russell" +
+    "Lee" walks as "russellee"). `tail` carries the last two letters walked.
+    """
+    found = []
+    node = trie
+    tail = ""
+    for length in range(1, max_words + 1):
+        if start + length > len(word_keys):
+            break
+        for ch in word_keys[start + length - 1]:
+            if tail == ch * 2:
+                continue
+            node = node.get(ch)
+            if node is None:
+                return found[::-1]
+            tail = tail[-1:] + ch
+        if "" in node:
+            found.append((length, node[""]))
+    return found[::-1]
+# ---------------------------------------------------------------------------
+
+
+# ---------------------------------------------------------------------------
+# Photo crops.
+# School photo PDFs store each portrait as a JPEG XObject, so the original
+# bytes can be copied straight out of the PDF instead of rasterising the
+# page region at 200 DPI and re-encoding it. Anything that isn't a plain,
+# unmasked, upright RGB/grey JPEG falls back to rendering the crop.
+# ---------------------------------------------------------------------------
+PHOTO_CROP_DPI = 200
+
+
+_COMPONENTS = {"DeviceGray": 1, "CalGray": 1, "DeviceRGB": 3, "CalRGB": 3, "DeviceCMYK": 4}
+
+
+def _pdf_name(obj):
+    return getattr(obj, "name", str(obj))
+
+
+def _colour_components(colorspace):
+    """
+    Number of colour components of an image colour space, following indirect
+    references (an ICCBased space reads N from its profile stream). Returns
+    None for Indexed / Separation / DeviceN / Pattern or anything unreadable.
+    """
+    colorspace = resolve1(colorspace)
+    if isinstance(colorspace, list):
+        if not colorspace:
+            return None
+        family = _pdf_name(resolve1(colorspace[0]))
+        if family == "ICCBased" and len(colorspace) > 1:
+            profile = resolve1(colorspace[1])
+            return resolve1(profile.get("N")) if isinstance(profile, PDFStream) else None
+        if len(colorspace) == 1:
+            return _colour_components(colorspace[0])
+        return _COMPONENTS.get(family) if family in ("CalGray", "CalRGB") else None
+    return _COMPONENTS.get(_pdf_name(colorspace))
+
+
+def embedded_jpeg_bytes(page, img):
+    """Returns the image's original JPEG stream bytes, or None if not safe to reuse."""
+    try:
+        stream = img.get('stream')
+        if stream is None or img.get('imagemask') or getattr(page, 'rotation', 0):
+            return None
+        if [_pdf_name(f) for f, _ in stream.get_filters()] != ['DCTDecode']:
+            return None
+        if 'SMask' in stream.attrs or 'Mask' in stream.attrs:
+            return None
+        # Only plain grey / RGB data copies over as-is: CMYK (including an
+        # ICCBased N=4 profile) or a non-default /Decode would come out
+        # inverted or in the wrong colours
+        n_comps = _colour_components(stream.get_any(("CS", "ColorSpace")))
+        if n_comps not in (1, 3):
+            return None
+        decode = resolve1(stream.get_any(("D", "Decode")))
+        if decode is not None and [resolve1(v) for v in decode] != [0, 1] * n_comps:
+            return None
+        # Drawn upright and uncropped? (a rotated or clipped placement would
+        # change the aspect ratio of the placed box vs the source pixels)
+        src_w, src_h = img['srcsize']
+        box_w, box_h = img['x1'] - img['x0'], img['bottom'] - img['top']
+        if not (src_w and src_h and box_w > 0 and box_h > 0):
+            return None
+        if abs((src_w / src_h) / (box_w / box_h) - 1) > 0.05:
+            return None
+        data = stream.get_rawdata()
+        if not data or data[:3] != b'\xff\xd8\xff':
+            return None
+        # The JPEG itself must agree (an Adobe CMYK/YCCK stream can sit
+        # behind a mislabelled colour space); only the header is parsed
+        return data if Image.open(BytesIO(data)).mode in ("L", "RGB") else None
+    except Exception as e:
+        print(f"    [DEBUG] Embedded JPEG not usable, rendering instead: {e}")
+        return None
+
+
+def crop_name(page_no, img_index):
+    """
+    File name for the crop of one page image. It depends only on the PDF,
+    never on the roster, so every scan of the same PDF agrees on what each
+    file holds and a crop never has to be deleted when a roster changes.
+    """
+    return f"p{page_no}_img{img_index}.jpg"
+
+
+def save_photo_crop(page, img, save_path):
+    """
+    Saves one photo from the page — original JPEG bytes when possible.
+    Written to a scratch file and renamed, so another session reading the
+    same cached crop never sees a half-written file.
+    """
+    tmp_path = f"{save_path}.{uuid.uuid4().hex}.tmp"
+    try:
+        data = embedded_jpeg_bytes(page, img)
+        if data:
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+        else:
+            bbox = (img['x0'], img['top'], img['x1'], img['bottom'])
+            page.within_bbox(bbox).to_image(resolution=PHOTO_CROP_DPI).original.save(
+                tmp_path, format="JPEG")
+        os.replace(tmp_path, save_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+# ---------------------------------------------------------------------------
+
+
+# ---------------------------------------------------------------------------
+# Orphan photos.
+# Unclaimed images are not cropped during the scan — most belong to students
+# who aren't on this trip. An orphan record keeps its page, image index and
+# bbox; the review list asks for small thumbnails, and the full crop is only
+# written to the record's path once a teacher assigns it to a student. Both
+# read the record's "source" — the copy of the PDF that was actually
+# scanned, kept beside its crops — never the shared upload path.
+# ---------------------------------------------------------------------------
+ORPHAN_THUMB_PX = 180   # longest edge; shown at 90 px, so sharp on HiDPI
+
+
+def _orphan_image(page, orphan):
+    """The page image an orphan record refers to (matched by index, then bbox)."""
+    images = page.images
+    idx = orphan["img_index"]
+    bbox = [round(v, 1) for v in orphan["bbox"]]
+    if idx < len(images) and _image_bbox(images[idx]) == bbox:
+        return images[idx]
+    for img in images:
+        if _image_bbox(img) == bbox:
+            return img
+    raise LookupError(f"image {idx} not found on page {orphan['page']}")
+
+
+def _image_bbox(img):
+    return [round(img['x0'], 1), round(img['top'], 1), round(img['x1'], 1), round(img['bottom'], 1)]
+
+
+def orphan_thumbnails(orphans, size=ORPHAN_THUMB_PX):
+    """
+    Returns {orphan path: JPEG thumbnail bytes, or None if it can't be made},
+    opening each source PDF at most once for the batch. Orphans whose crop
+    already exists are thumbnailed from it; a source PDF that has gone (pruned,
+    or never pinned) only costs its orphans their previews.
+    """
+    thumbs = {}
+    by_source = {}
+    for orphan in orphans:
+        by_source.setdefault(orphan["source"], []).append(orphan)
+    for source, batch in by_source.items():
+        thumbs.update(_orphan_thumbnails_from(source, batch, size))
+    return thumbs
+
+
+def _orphan_thumbnails_from(pdf_path, orphans, size):
+    thumbs = {}
+    pdf = None
+    try:
+        for orphan in orphans:
+            thumbs[orphan["path"]] = None
+            try:
+                if os.path.exists(orphan["path"]):
+                    im = Image.open(orphan["path"])
+                else:
+                    if pdf is None:
+                        pdf = pdfplumber.open(pdf_path)
+                    page = pdf.pages[orphan["page"] - 1]
+                    img = _orphan_image(page, orphan)
+                    data = embedded_jpeg_bytes(page, img)
+                    if data:
+                        im = Image.open(BytesIO(data))
+                        im.draft("RGB", (size, size))  # JPEG decodes at a reduced scale
+                    else:
+                        longest = max(img['x1'] - img['x0'], img['bottom'] - img['top'])
+                        bbox = (img['x0'], img['top'], img['x1'], img['bottom'])
+                        im = page.within_bbox(bbox).to_image(
+                            resolution=72 * size / longest).original
+                im = im.convert("RGB")
+                im.thumbnail((size, size))
+                buf = BytesIO()
+                im.save(buf, format="JPEG", quality=80)
+                thumbs[orphan["path"]] = buf.getvalue()
+            except Exception as e:
+                print(f"    [ERROR] Thumbnail for orphan {orphan['path']}: {e}")
+    finally:
+        if pdf is not None:
+            pdf.close()
+    return thumbs
+
+
+def save_orphan_crop(orphan):
+    """
+    Writes the full crop for an orphan record to its path (once). Returns the
+    path, or None when it can't be cut — e.g. its source PDF has been pruned.
+    """
+    if os.path.exists(orphan["path"]):
+        return orphan["path"]
+    try:
+        with pdfplumber.open(orphan["source"]) as pdf:
+            page = pdf.pages[orphan["page"] - 1]
+            save_photo_crop(page, _orphan_image(page, orphan), orphan["path"])
+    except Exception as e:
+        print(f"    [ERROR] Cropping orphan {orphan['path']}: {e}")
+        return None
+    return orphan["path"]
+# ---------------------------------------------------------------------------
+
+
+# ---------------------------------------------------------------------------
+# Photo grid model.
+# School photo PDFs lay portraits out in a regular grid with each name
+# printed under its photo. infer_photo_grid() clusters the page's portrait
+# boxes into rows and columns; a name label then maps to the cell directly
+# above it with two bisects, taking its bands from the page's own spacing
+# instead of the hand-tuned gap constants. Pages whose images don't form a
+# clean grid return None and use the geometric search below.
+# ---------------------------------------------------------------------------
+GRID_ALIGN_TOL = 10    # points a row's tops / a column's centres may wander
+GRID_SIZE_TOL  = 0.25  # portraits within ±25% of the median size count as cells
+
+
+def _cluster(values, tol):
+    """Groups sorted (value, idx) pairs whose value is within tol of the group's first."""
+    groups = []
+    for value, idx in values:
+        if groups and value - groups[-1][0][0] <= tol:
+            groups[-1].append((value, idx))
+        else:
+            groups.append([(value, idx)])
+    return groups
+
+
+def infer_photo_grid(images):
+    """
+    Returns the page's photo grid, or None when the portraits don't form one:
+    { "cells": {(row, col): image index}, "row_bottoms": [...],
+      "row_tops": [...], "row_height": h, "col_splits": [...],
+      "col_x0": [...], "col_x1": [...] }
+    """
+    portraits = [
+        idx for idx, img in enumerate(images)
+        if (img['x1'] - img['x0']) >= 30 and (img['bottom'] - img['top']) >= 30
+    ]
+    if len(portraits) < 2:
+        return None
+    widths  = sorted(images[i]['x1'] - images[i]['x0'] for i in portraits)
+    heights = sorted(images[i]['bottom'] - images[i]['top'] for i in portraits)
+    med_w, med_h = widths[len(widths) // 2], heights[len(heights) // 2]
+    # Logos / banners of a different size stay out of the grid
+    portraits = [
+        i for i in portraits
+        if abs((images[i]['x1'] - images[i]['x0']) - med_w) <= GRID_SIZE_TOL * med_w
+        and abs((images[i]['bottom'] - images[i]['top']) - med_h) <= GRID_SIZE_TOL * med_h
+    ]
+    if len(portraits) < 2:
+        return None
+
+    rows = _cluster(sorted((images[i]['top'], i) for i in portraits), GRID_ALIGN_TOL)
+    cols = _cluster(sorted(((images[i]['x0'] + images[i]['x1']) / 2, i) for i in portraits),
+                    GRID_ALIGN_TOL)
+    row_of = {i: r for r, group in enumerate(rows) for _, i in group}
+    col_of = {i: c for c, group in enumerate(cols) for _, i in group}
+
+    cells = {}
+    for i in portraits:
+        cell = (row_of[i], col_of[i])
+        if cell in cells:
+            return None  # two portraits in one cell: not a grid
+        cells[cell] = i
+
+    row_tops    = [min(images[i]['top'] for _, i in group) for group in rows]
+    row_bottoms = [max(images[i]['bottom'] for _, i in group) for group in rows]
+    col_x0      = [min(images[i]['x0'] for _, i in group) for group in cols]
+    col_x1      = [max(images[i]['x1'] for _, i in group) for group in cols]
+    # Bands must not overlap, or a label could belong to two cells
+    if any(row_bottoms[r] >= row_tops[r + 1] for r in range(len(rows) - 1)):
+        return None
+    if any(col_x1[c] >= col_x0[c + 1] for c in range(len(cols) - 1)):
+        return None
+
+    return {
+        "cells":       cells,
+        "row_tops":    row_tops,
+        "row_bottoms": row_bottoms,
+        "row_height":  med_h,
+        # A label belongs to the column whose gap-midpoints enclose its centre
+        "col_splits":  [(col_x1[c] + col_x0[c + 1]) / 2 for c in range(len(cols) - 1)],
+        "col_x0":      col_x0,
+        "col_x1":      col_x1,
+    }
+
+
+def grid_cell_above(grid, label_top, label_cx):
+    """Image index of the grid cell a name label sits under, or None."""
+    row = bisect.bisect_right(grid["row_bottoms"], label_top) - 1
+    if row < 0:
+        return None
+    # The label must sit in the band between its row and the next one
+    if row + 1 < len(grid["row_tops"]):
+        if label_top >= grid["row_tops"][row + 1]:
+            return None
+    elif label_top - grid["row_bottoms"][row] > grid["row_height"]:
+        return None
+    col = bisect.bisect_right(grid["col_splits"], label_cx)
+    pad = (grid["col_x1"][col] - grid["col_x0"][col]) / 2
+    if not (grid["col_x0"][col] - pad <= label_cx <= grid["col_x1"][col] + pad):
+        return None
+    return grid["cells"].get((row, col))
+# ---------------------------------------------------------------------------
+
+
+# ---------------------------------------------------------------------------
+# Geometry constants (points)
+# ---------------------------------------------------------------------------
+MAX_V_GAP        = 35
+LOOKAHEAD_FENCE  = 40
+SAME_LINE_TOL    = 8
+COL_PAD          = 30
+
+
+def page_roster_fingerprint(word_keys, student_map, surname_trie):
+    """
+    Hash of the roster entries a page can actually match — every surname key
+    found anywhere in its words, with those students' id/first/roll. A page
+    whose fingerprint is unchanged would match exactly as before, so a
+    cached result for it can be reused after unrelated roster edits.
+    """
+    found = set()
+    for i in range(len(word_keys)):
+        for _, text in surname_matches(surname_trie, word_keys, i):
+            found.add(text)
+    relevant = {key: student_map[key] for key in sorted(found)}
+    return hashlib.sha256(json.dumps(relevant, sort_keys=True).encode()).hexdigest()
+
+
+def default_extract_workers():
+    """Sensible default pool size — leave one core free for the app itself."""
+    return max(1, min(4, (os.cpu_count() or 1) - 1))
+
+
+def extract_page(page, page_num, student_map, surname_trie, output_dir, layout="free"):
+    """
+    Matches names to photos on one page and saves the crops to output_dir.
+    layout="grid" places names through infer_photo_grid() first, using the
+    geometric search for labels (or pages) the grid can't place.
+    Returns { "page": n, "results": {sid: path},
+              "placements": {sid: {"img_index", "bbox"}}, "unmatched": [orphan…],
+              "diagnostics": [match…], "word_keys": [...], "roster": hash,
+              "pua_chars": set() }.
+    placements locate each claimed photo on the page, so it can be cut again
+    if it later has to be reviewed as an orphan.
+    """
+    results = {}
+    placements = {}
+    unmatched_data = []
+    diagnostics = []
+
+    print(f"\n[DEBUG] Processing Page {page_num + 1}...")
+    words  = build_word_table(page.extract_words())
+    images = page.images
+    claimed_images = set()
+    word_grid = build_word_grid(words)
+    word_keys = words["key"]
+    n_words   = len(word_keys)
+
+    print(f"[DEBUG] Found {n_words} words and {len(images)} images on page.")
+
+    grid = infer_photo_grid(images) if layout == "grid" else None
+    if grid is not None:
+        print(f"[Grid] {len(grid['row_tops'])} rows × {len(grid['col_x0'])} columns, "
+              f"{len(grid['cells'])} portraits")
+    elif layout == "grid":
+        print("[Grid] No regular photo grid on this page — using geometric matching")
+
+    # ----------------------------------------------------------
+    # A. NAME MATCHING
+    # ----------------------------------------------------------
+    i = 0
+    while i < n_words:
+        words_skipped = 1
+
+        for length, text in surname_matches(surname_trie, word_keys, i):
+            phrase = slice(i, i + length)
+
+            # SAME-LINE GUARD — with wrapped-surname relaxation.
+            # Multi-word surnames (e.g. "Jarretto Handerstaay") and
+            # hyphenated names with a space ("Duskett- McDann") can
+            # wrap onto the next line in a narrow photo-label column.
+            # In those cases the words' `top` values differ by one
+            # full line height (~12 px), exceeding SAME_LINE_TOL=8
+            # and causing a missed match.
+            # For multi-word phrases we allow the relaxed tolerance
+            # when the words stay inside the same narrow column
+            # (x-centre spread < 70 px) and appear in reading order.
+            tops = words["top"][phrase]
+            vertical_spread = max(tops) - min(tops)
+            if vertical_spread > SAME_LINE_TOL:
+                if length > 1:
+                    # Are all words horizontally within the same narrow column?
+                    x_centres = words["cx"][phrase]
+                    same_col   = (max(x_centres) - min(x_centres)) < 70
+                    # Also allow when the first word ends in '-' (hyphenated wrap)
+                    is_hyphen_wrap = words["raw"][i].rstrip().endswith('-')
+                    # Words must appear in descending / non-reversed order (top-to-bottom)
+                    in_order = all(
+                        tops[j] <= tops[j+1] + 5
+                        for j in range(len(tops) - 1)
+                    )
+                    if (same_col or is_hyphen_wrap) and in_order and vertical_spread <= 22:
+                        pass  # allow this wrapped multi-word phrase
+                    else:
+                        continue
+                else:
+                    continue
+
+            # --- FOUND A SURNAME MATCH ---
+            candidates = student_map[text]
+
+            # Spatial bounds
+            surname_bottom = max(words["bottom"][phrase])
+            phrase_x0      = min(words["x0"][phrase])
+            phrase_x1      = max(words["x1"][phrase])
+            col_x0 = phrase_x0 - COL_PAD
+            col_x1 = phrase_x1 + COL_PAD
+
+            # SPATIALLY-FILTERED LOOKAHEAD
+            nearby_text_parts = []
+            for w_idx in words_near(word_grid, surname_bottom - 2,
+                                    surname_bottom + LOOKAHEAD_FENCE, col_x0, col_x1):
+                top = words["top"][w_idx]
+                if top < surname_bottom - 2: continue
+                if top > surname_bottom + LOOKAHEAD_FENCE: continue
+                if words["x1"][w_idx] < col_x0 or words["x0"][w_idx] > col_x1: continue
+                nearby_text_parts.append(words["text"][w_idx])
+
+            nearby_text = " ".join(nearby_text_parts)
+
+            # PICK THE STUDENT
+            matched_student_id = None
+            disambiguation_method = "Single Match"
+
+            if len(candidates) == 1:
+                matched_student_id = candidates[0]['id']
+            else:
+                disambiguation_method = "First Name"
+                for cand in candidates:
+                    if cand['first'] and cand['first'] in nearby_text:
+                        matched_student_id = cand['id']
+                        break
+
+                if matched_student_id is None:
+                    disambiguation_method = "Roll Group"
+                    for cand in candidates:
+                        if cand['roll'] and cand['roll'] in nearby_text:
+                            matched_student_id = cand['id']
+                            break
+
+            if matched_student_id is None:
+                print(f"  [DEBUG] AMBIGUOUS: Found surname '{text}' but could not match First/Roll in nearby text: '{nearby_text}'")
+                diagnostics.append({"surname": text, "id": None, "method": "Ambiguous",
+                                    "nearby": nearby_text, "gap": None})
+                continue
+
+            print(f"  [DEBUG] MATCHED Name: '{text}' -> ID: {matched_student_id} (via {disambiguation_method})")
+
+            # GEOMETRY: Find photo
+            phrase_top = min(tops)
+            phrase_cx  = (phrase_x0 + phrase_x1) / 2
+
+            best_img_idx = None
+            best_img     = None
+            min_gap      = 9999
+            placed_by    = "geometric"
+
+            if grid is not None:
+                cell_idx = grid_cell_above(grid, phrase_top, phrase_cx)
+                if cell_idx is not None and cell_idx not in claimed_images:
+                    best_img_idx = cell_idx
+                    best_img     = images[cell_idx]
+                    min_gap      = phrase_top - best_img['bottom']
+                    placed_by    = "grid"
+
+            if best_img is None:
+                for img_idx, img in enumerate(images):
+                    if img_idx in claimed_images: continue # Skip already taken
+
+                    img_bot = img['bottom']
+                    if img_bot >= phrase_top: continue # Not above
+
+                    gap = phrase_top - img_bot
+                    if gap > MAX_V_GAP: 
+                        # Debug log for rejection if it's kinda close but failed
+                        if gap < MAX_V_GAP + 20:
+                            print(f"    [Img {img_idx}] REJECTED: Too high (Gap {gap:.1f} > {MAX_V_GAP})")
+                        continue
+
+                    img_cx = (img['x0'] + img['x1']) / 2
+                    h_dist = abs(img_cx - phrase_cx)
+                    allowed_h_dist = (phrase_x1 - phrase_x0) / 2 + 40
+
+                    if h_dist > allowed_h_dist:
+                        # Debug log for rejection if aligned vertically but off horizontally
+                        print(f"    [Img {img_idx}] REJECTED: Off-center (Dist {h_dist:.1f} > {allowed_h_dist:.1f})")
+                        continue
+
+                    # If we get here, it's a valid candidate
+                    if gap < min_gap:
+                        min_gap      = gap
+                        best_img     = img
+                        best_img_idx = img_idx
+
+            diagnostics.append({"surname": text, "id": matched_student_id,
+                                "method": disambiguation_method, "nearby": nearby_text,
+                                "gap": round(min_gap, 1) if best_img else None,
+                                "placed_by": placed_by if best_img else None})
+            if best_img:
+                print(f"    [Img {best_img_idx}] CLAIMED ({placed_by}): Gap={min_gap:.1f}")
+                try:
+                    claimed_images.add(best_img_idx)
+                    # Named by page and image, not student: parallel workers may
+                    # match the same student on two pages (the merge step decides
+                    # which wins), and an earlier scan may already have cut it
+                    save_path = os.path.join(output_dir, crop_name(page_num + 1, best_img_idx))
+                    if not os.path.exists(save_path):
+                        save_photo_crop(page, best_img, save_path)
+                    results[matched_student_id] = save_path
+                    placements[matched_student_id] = {"img_index": best_img_idx,
+                                                      "bbox": _image_bbox(best_img)}
+                except Exception as e:
+                    print(f"    [ERROR] Saving image: {e}")
+            else:
+                print(f"    [WARNING] No valid image found above '{text}' (Max Gap: {MAX_V_GAP})")
+
+            words_skipped = length
+            break 
+
+        i += words_skipped
+
+    # ----------------------------------------------------------
+    # B. ORPHAN IMAGES
+    # ----------------------------------------------------------
+    for img_idx, img in enumerate(images):
+        if img_idx in claimed_images:
+            continue
+        try:
+            if (img['x1'] - img['x0']) < 30 or (img['bottom'] - img['top']) < 30:
+                continue
+
+            print(f"  [DEBUG] Orphan Image Found: Index {img_idx}")
+
+            # Cropped later, only if someone assigns it (see save_orphan_crop)
+            save_path = os.path.join(output_dir, crop_name(page_num + 1, img_idx))
+
+            nearby_text = []
+            img_bottom  = img['bottom']
+            for w_idx in words_near(word_grid, img_bottom, img_bottom + 50, img['x0'], img['x1']):
+                # Look BELOW the orphan
+                if img_bottom < words["top"][w_idx] < (img_bottom + 50):
+                    if (words["x0"][w_idx] < img['x1']) and (words["x1"][w_idx] > img['x0']):
+                        nearby_text.append(words["raw"][w_idx])
+
+            found_text = " ".join(nearby_text) if nearby_text else "No text found immediately below"
+            print(f"    -> Text below orphan: {found_text}")
+
+            unmatched_data.append({
+                "path":       save_path,
+                "text_found": found_text,
+                "page":       page_num + 1,
+                "img_index":  img_idx,
+                "bbox":       _image_bbox(img),
+            })
+        except Exception as e:
+            print(f"    [ERROR] Processing orphan {img_idx}: {e}")
+
+    return {
+        "page": page_num + 1,
+        "results": results,
+        "placements": placements,
+        "unmatched": unmatched_data,
+        "diagnostics": diagnostics,
+        "word_keys": word_keys,
+        "roster": page_roster_fingerprint(word_keys, student_map, surname_trie),
+        "pua_chars": set(_SEEN_PUA_CHARS),
+    }
+
+
+# ---------------------------------------------------------------------------
+# Page scheduling
+# ---------------------------------------------------------------------------
+# Per-worker state, set once by _init_page_worker. Each worker opens the
+# photo PDF itself on first use and keeps it open for the pages it is given.
+_WORKER = {}
+
+
+def _init_page_worker(pdf_path, student_map, output_dir, layout):
+    _WORKER.clear()
+    _WORKER.update(
+        pdf_path=pdf_path, pdf=None, student_map=student_map,
+        surname_trie=build_surname_trie(student_map), output_dir=output_dir,
+        layout=layout,
+    )
+
+
+def _extract_page_job(page_num):
+    if _WORKER["pdf"] is None:
+        _WORKER["pdf"] = pdfplumber.open(_WORKER["pdf_path"])
+    page = _WORKER["pdf"].pages[page_num]
+    try:
+        return extract_page(page, page_num, _WORKER["student_map"],
+                            _WORKER["surname_trie"], _WORKER["output_dir"],
+                            layout=_WORKER["layout"])
+    finally:
+        page.close()
+
+
+def extract_pages(pdf_path, student_map, output_dir, max_workers=1, page_nums=None,
+                  layout="free"):
+    """
+    Scans the photo PDF and yields extract_page() results in page order,
+    whichever worker finishes first. page_nums (0-based) limits the scan to
+    those pages. max_workers <= 1 (or a single page) scans in-process.
+    """
+    with pdfplumber.open(pdf_path) as pdf:
+        if page_nums is None:
+            page_nums = range(len(pdf.pages))
+        page_nums = sorted(page_nums)
+        if not page_nums:
+            return
+        n_workers = max(1, min(int(max_workers or 1), len(page_nums)))
+        if n_workers == 1:
+            surname_trie = build_surname_trie(student_map)
+            for page_num in page_nums:
+                page = pdf.pages[page_num]
+                try:
+                    yield extract_page(page, page_num, student_map, surname_trie, output_dir,
+                                       layout=layout)
+                finally:
+                    page.close()
+            return
+
+    # 'spawn' for the same reason as booklet_render: never fork the server
+    ctx = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=n_workers, mp_context=ctx,
+                             initializer=_init_page_worker,
+                             initargs=(pdf_path, student_map, output_dir, layout)) as pool:
+        for result in pool.map(_extract_page_job, page_nums):
+            yield result
@@ -0,0 +1,175 @@
+"""Page-range, splitting and link-resolution helpers used to compose booklets."""
+import random
+from io import BytesIO
+
+import pytest
+from PIL import Image
+from pypdf import PdfReader, PdfWriter
+from pypdf.generic import (
+    ArrayObject, DictionaryObject, FloatObject, NameObject, NumberObject,
+    StreamObject, TextStringObject,
+)
+
+try:
+    import booklet_render
+except OSError:  # WeasyPrint is installed but its Pango/Cairo libraries are not
+    pytest.skip("WeasyPrint system libraries unavailable", allow_module_level=True)
+
+
+def make_part(widths, anchors, links=None):
+    """
+    A part as render_part() returns it. Page i is widths[i] points wide so
+    tests can tell pages apart; links maps page index → named targets.
+    """
+    writer = PdfWriter()
+    for page_index, width in enumerate(widths):
+        page = writer.add_blank_page(width=width, height=200)
+        annots = ArrayObject()
+        for name in (links or {}).get(page_index, ()):
+            annot = DictionaryObject({
+                NameObject("/Type"): NameObject("/Annot"),
+                NameObject("/Subtype"): NameObject("/Link"),
+                NameObject("/Rect"): ArrayObject([FloatObject(0)] * 4),
+                NameObject("/Dest"): TextStringObject(name),
+            })
+            annots.append(writer._add_object(annot))
+        if annots:
+            page[NameObject("/Annots")] = annots
+    buf = BytesIO()
+    writer.write(buf)
+    return {"pdf": buf.getvalue(), "page_count": len(widths), "anchors": anchors}
+
+
+def page_widths(pdf_bytes):
+    return [round(float(p.mediabox.width)) for p in PdfReader(BytesIO(pdf_bytes)).pages]
+
+
+def link_target_widths(pdf_bytes):
+    reader = PdfReader(BytesIO(pdf_bytes))
+    targets = []
+    for page in reader.pages:
+        for annot in page.get("/Annots", None) or []:
+            dest = annot.get_object()["/Dest"]
+            targets.append(round(float(dest[0].get_object()["/MediaBox"][2])))
+    return targets
+
+
+PROFILES = make_part(
+    [101, 102, 103, 104],
+    {"student-a": (0, 0, 200), "attach-a": (1, 0, 200), "student-b": (2, 0, 200)},
+    links={0: ["photo-index"], 2: ["photo-index"]},
+)
+
+
+def test_student_page_ranges_keep_attachment_pages_with_their_profile():
+    assert booklet_render.student_page_ranges(PROFILES) == {"a": (0, 2), "b": (2, 4)}
+
+
+def test_split_student_pages_gives_each_student_only_their_pages():
+    pieces = booklet_render.split_student_pages(PROFILES)
+    assert set(pieces) == {"a", "b"}
+    assert page_widths(pieces["a"]["pdf"]) == [101, 102]
+    assert page_widths(pieces["b"]["pdf"]) == [103, 104]
+    assert pieces["a"]["anchors"] == {"student-a": (0, 0, 200), "attach-a": (1, 0, 200)}
+    assert pieces["b"]["anchors"] == {"student-b": (0, 0, 200)}
+    assert pieces["b"]["page_count"] == 2
+
+
+def test_split_pieces_compose_with_links_resolved():
+    pieces = booklet_render.split_student_pages(PROFILES)
+    front = make_part([50], {"photo-index": (0, 0, 200)}, links={0: ["student-b", "student-a"]})
+    student_pages = {lid: (piece, (0, piece["page_count"])) for lid, piece in pieces.items()}
+    pdf = booklet_render.compose_booklet(front, student_pages, ["b", "a"])
+    # front, then b's pages, then a's, then the trailing blank page
+    assert page_widths(pdf)[:-1] == [50, 103, 104, 101, 102]
+    # front → b, front → a, b → photo index, a → photo index
+    assert link_target_widths(pdf) == [103, 101, 50, 50]
+
+
+def image_xobject(writer, data):
+    stream = StreamObject()
+    stream._data = data
+    stream.update({
+        NameObject("/Type"): NameObject("/XObject"),
+        NameObject("/Subtype"): NameObject("/Image"),
+        NameObject("/Width"): NumberObject(1),
+        NameObject("/Height"): NumberObject(1),
+        NameObject("/ColorSpace"): NameObject("/DeviceGray"),
+        NameObject("/BitsPerComponent"): NumberObject(8),
+    })
+    return writer._add_object(stream)
+
+
+def test_deduplicate_resources_merges_identical_images():
+    writer = PdfWriter()
+    for data in (b"\x10", b"\x10", b"\x20"):
+        page = writer.add_blank_page(width=100, height=100)
+        page[NameObject("/Resources")] = DictionaryObject({
+            NameObject("/XObject"): DictionaryObject({
+                NameObject("/Im0"): image_xobject(writer, data),
+            }),
+        })
+    assert booklet_render.deduplicate_resources(writer) == 1
+    refs = [page["/Resources"]["/XObject"].raw_get("/Im0").idnum for page in writer.pages]
+    assert refs[0] == refs[1] != refs[2]
+
+    buf = BytesIO()
+    writer.write(buf)
+    reader = PdfReader(buf)
+    assert [p["/Resources"]["/XObject"]["/Im0"].get_data() for p in reader.pages] == [b"\x10", b"\x10", b"\x20"]
+
+
+def jpeg_xobject(writer, data):
+    stream = image_xobject(writer, data).get_object()
+    stream.update({
+        NameObject("/Width"): NumberObject(40),
+        NameObject("/Height"): NumberObject(50),
+        NameObject("/ColorSpace"): NameObject("/DeviceRGB"),
+        NameObject("/Filter"): NameObject("/DCTDecode"),
+    })
+    return stream.indirect_reference
+
+
+def photo_part(jpeg, width, anchors):
+    """A one-page part showing `jpeg`, embedded the way WeasyPrint embeds a JPEG."""
+    writer = PdfWriter()
+    page = writer.add_blank_page(width=width, height=200)
+    page[NameObject("/Resources")] = DictionaryObject({
+        NameObject("/XObject"): DictionaryObject({NameObject("/Im0"): jpeg_xobject(writer, jpeg)}),
+    })
+    buf = BytesIO()
+    writer.write(buf)
+    return {"pdf": buf.getvalue(), "page_count": 1, "anchors": anchors}
+
+
+def booklet_sizes(grid_jpeg, profile_jpeg):
+    """Byte size of a photo grid + profile booklet before and after write_booklet()."""
+    front = photo_part(grid_jpeg, 50, {})
+    profile = photo_part(profile_jpeg, 101, {"student-a": (0, 0, 200)})
+    student_pages = {"a": (profile, (0, 1))}
+
+    writer = PdfWriter()
+    booklet_render.append_booklet(writer, front, student_pages, ["a"])
+    before = BytesIO()
+    writer.write(before)
+    after = booklet_render.compose_booklet(front, student_pages, ["a"])
+    return len(before.getvalue()), len(after)
+
+
+def noise_jpeg(seed):
+    rng = random.Random(seed)
+    buf = BytesIO()
+    Image.frombytes("RGB", (40, 50), bytes(rng.randrange(256) for _ in range(40 * 50 * 3))).save(
+        buf, format="JPEG", quality=95)
+    return buf.getvalue()
+
+
+def test_same_photo_in_grid_and_profile_is_written_once():
+    jpeg = noise_jpeg(1)
+    before, after = booklet_sizes(jpeg, jpeg)
+    assert before - after >= len(jpeg)
+
+
+def test_differently_encoded_copies_are_not_merged():
+    before, after = booklet_sizes(noise_jpeg(1), noise_jpeg(2))
+    assert before - after < len(noise_jpeg(1)) // 2
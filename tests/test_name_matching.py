@@ -0,0 +1,101 @@
+"""Roster name index, Paperly form-row matching and fuzzy suggestions."""
+import pandas as pd
+import pytest
+
+from name_matching import (
+    build_fuzzy_name_index, build_roster_name_index, fuzzy_name_candidates,
+    match_names_to_roster, suggest_roster_matches,
+)
+
+COLS = {"student_id": "Code", "first_name": "First name", "surname": "Surname"}
+
+
+def roster(*students):
+    return build_roster_name_index(pd.DataFrame(
+        [{"Code": sid, "First name": first, "Surname": surname, "Preferred name": pref}
+         for sid, first, surname, pref in students]
+    ), COLS)
+
+
+def test_index_flags_shared_surnames_and_tokenises_them():
+    index = roster(("1", "Ann", "Smith", ""), ("2", "Bob", "Smith", ""), ("3", "Cy", "Van Der Berg", ""))
+    assert [s["has_dup"] for s in index] == [True, True, False]
+    assert index[2]["surname_tokens"] == ["van", "der", "berg"]
+
+
+def test_surname_must_match_as_a_whole_word():
+    index = roster(("1", "Ann", "Lee", ""))
+    assert match_names_to_roster(index, ["ann leeson", "ann lee"]) == {"1": 1}
+
+
+def test_shared_surname_needs_first_or_preferred_name():
+    index = roster(("1", "Katherine", "Smith", "Kate"), ("2", "John", "Smith", ""))
+    texts = ["smith", "kate smith", "john smith"]
+    assert match_names_to_roster(index, texts) == {"1": 1, "2": 2}
+
+
+def test_each_row_goes_to_one_student_in_roster_order():
+    index = roster(("1", "Ann", "Jones", ""), ("2", "Bob", "Brown", ""))
+    assert match_names_to_roster(index, ["ann jones", "ann jones", "bob brown"]) == {"1": 0, "2": 2}
+
+
+def test_unusable_rows_are_skipped():
+    index = roster(("1", "Ann", "Jones", ""))
+    assert match_names_to_roster(index, ["ann jones", "ann jones"], usable=[False, True]) == {"1": 1}
+
+
+def test_multi_word_surname_needs_every_token():
+    index = roster(("1", "Cy", "Van Der Berg", ""))
+    assert match_names_to_roster(index, ["cy van berg", "cy van der berg"]) == {"1": 1}
+
+
+# ---------------------------------------------------------------------------
+# Fuzzy suggestions
+# ---------------------------------------------------------------------------
+FUZZY_ROSTER = roster(
+    ("1", "Katherine", "Smith-Jones", "Kate"),
+    ("2", "John", "Smith", ""),
+    ("3", "Jon", "Smyth", ""),
+    ("4", "Oliver", "McDonald", "Ollie"),
+)
+
+
+@pytest.mark.parametrize("text, sid", [
+    ("Kate Smith Jones", "1"),      # preferred name, hyphen dropped
+    ("Katherine Smithjones", "1"),  # hyphen closed up
+    ("Olivre Mcdonald", "4"),       # typo
+    ("Ollie MacDonald", "4"),       # nickname + spelling variant
+])
+def test_fuzzy_candidates_rank_the_right_student_first(text, sid):
+    candidates = fuzzy_name_candidates(build_fuzzy_name_index(FUZZY_ROSTER), text)
+    assert candidates[0][0] == sid
+    assert [score for _, score in candidates] == sorted((score for _, score in candidates), reverse=True)
+
+
+def test_fuzzy_candidates_for_an_unrelated_name_score_low():
+    candidates = fuzzy_name_candidates(build_fuzzy_name_index(FUZZY_ROSTER), "Xavier Zed")
+    assert all(score < 0.2 for _, score in candidates)
+    assert fuzzy_name_candidates(build_fuzzy_name_index(FUZZY_ROSTER), "12 -") == []
+
+
+def test_suggest_auto_accepts_only_clear_unclaimed_winners():
+    items = [{"index": i, "student_name": name} for i, name in enumerate(
+        ["Kate Smith Jones", "Jon Smith", "Katherine Smith-Jones", "Olivre Mcdonald"]
+    )]
+    accepted = suggest_roster_matches(
+        build_fuzzy_name_index(FUZZY_ROSTER), items,
+        lambda r: r["student_name"], lambda r: r["index"], taken={"4": object()},
+    )
+    # 0: clear winner. 1: John Smith is only a weak lead over Jon Smyth.
+    # 2: same student already auto-accepted for row 0. 3: below threshold.
+    assert accepted == {0: "1"}
+    assert items[1]["suggestions"][0][0] == "2" and len(items[1]["suggestions"]) > 1
+    assert all(score >= 0.45 for item in items for _, score in item["suggestions"])
+
+
+def test_auto_accept_threshold_is_configurable():
+    items = [{"index": 0, "student_name": "Olivre Mcdonald"}]
+    fuzzy_index = build_fuzzy_name_index(FUZZY_ROSTER)
+    args = (fuzzy_index, items, lambda r: r["student_name"], lambda r: r["index"])
+    assert suggest_roster_matches(*args) == {}
+    assert suggest_roster_matches(*args, auto_accept=0.7) == {0: "4"}
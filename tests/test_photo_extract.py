@@ -0,0 +1,276 @@
+"""Surname matching, grid and fingerprint helpers from the photo-PDF scanner."""
+import os
+from io import BytesIO
+
+import pdfplumber
+import pytest
+from PIL import Image
+
+from photo_extract import (
+    build_surname_trie, build_word_grid, build_word_table, clean_ligatures,
+    embedded_jpeg_bytes, extract_page, grid_cell_above, infer_photo_grid,
+    orphan_thumbnails, page_roster_fingerprint, save_orphan_crop, surname_matches,
+    words_near,
+)
+
+
+def roster_key(surname):
+    """Same key extract_photos_geometric() builds for a roster surname."""
+    return clean_ligatures(surname.lower().replace(" ", "").replace("-", "").replace("'", ""))
+
+
+@pytest.mark.parametrize("surname, words", [
+    ("Smith", ["smith"]),
+    ("Van Der Berg", ["van", "der", "berg"]),
+    ("Duskett-McDann", ["duskett", "mcdann"]),
+    # Regression: a triple letter across the word gap ("russelllee") is
+    # collapsed when the key is built, so the walk has to collapse it too
+    ("Russell Lee", ["russell", "lee"]),
+    ("Hall Lloyd", ["hall", "lloyd"]),
+])
+def test_multi_word_surnames_match(surname, words):
+    trie = build_surname_trie([roster_key(surname)])
+    assert surname_matches(trie, words, 0) == [(len(words), roster_key(surname))]
+
+
+def test_longest_phrase_first():
+    trie = build_surname_trie(["van", "vanderberg"])
+    assert surname_matches(trie, ["van", "der", "berg", "x"], 0) == [(3, "vanderberg"), (1, "van")]
+
+
+def test_no_match_stops_early():
+    trie = build_surname_trie(["smith"])
+    assert surname_matches(trie, ["jones", "smith"], 0) == []
+    assert surname_matches(trie, ["jones", "smith"], 1) == [(1, "smith")]
+
+
+def test_run_across_gap_collapses_to_two_letters():
+    assert roster_key("Lee Ellis") == "leellis"
+    trie = build_surname_trie(["leellis"])
+    assert surname_matches(trie, ["lee", "ellis"], 0) == [(2, "leellis")]
+    # Plain doubles on either side of the gap are untouched
+    trie = build_surname_trie(["leeann"])
+    assert surname_matches(trie, ["lee", "ann"], 0) == [(2, "leeann")]
+
+
+# ---------------------------------------------------------------------------
+# Embedded JPEG passthrough
+# ---------------------------------------------------------------------------
+def jpeg_of(im):
+    buf = BytesIO()
+    im.save(buf, format="JPEG")
+    return buf.getvalue()
+
+
+def jpeg_bytes(mode="RGB"):
+    return jpeg_of(Image.new(mode, (40, 50), (200, 30, 30) if mode == "RGB" else 0))
+
+
+def photo_pdf(jpeg, colorspace="/DeviceRGB", decode=None, extra_objects=(), label=None):
+    """
+    A one-page PDF drawing `jpeg` upright at 40×50 pt, with `label` printed
+    just below it. colorspace is written verbatim into the image dictionary;
+    extra_objects become objects 7, 8, …
+    """
+    decode = f" /Decode {decode}" if decode else ""
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"<< /Type /Pages /Kids [3 0 R] /Count 1 >>",
+        b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 200 200] "
+        b"/Resources << /XObject << /Im0 5 0 R >> /Font << /F1 6 0 R >> >> /Contents 4 0 R >>",
+    ]
+    content = b"q 40 0 0 50 10 100 cm /Im0 Do Q"
+    if label:
+        content += b" BT /F1 8 Tf 12 88 Td (%s) Tj ET" % label.encode()
+    objects.append(b"<< /Length %d >>\nstream\n" % len(content) + content + b"\nendstream")
+    objects.append(
+        (f"<< /Type /XObject /Subtype /Image /Width 40 /Height 50 /ColorSpace {colorspace} "
+         f"/BitsPerComponent 8 /Filter /DCTDecode{decode} /Length {len(jpeg)} >>\nstream\n").encode()
+        + jpeg + b"\nendstream"
+    )
+    objects.append(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+    objects.extend(extra_objects)
+    out, offsets = BytesIO(), []
+    out.write(b"%PDF-1.4\n")
+    for n, body in enumerate(objects, 1):
+        offsets.append(out.tell())
+        out.write(b"%d 0 obj\n" % n + body + b"\nendobj\n")
+    xref = out.tell()
+    out.write(b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1))
+    for offset in offsets:
+        out.write(b"%010d 00000 n \n" % offset)
+    out.write(b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref))
+    return out.getvalue()
+
+
+def passthrough(pdf_bytes):
+    with pdfplumber.open(BytesIO(pdf_bytes)) as pdf:
+        page = pdf.pages[0]
+        return embedded_jpeg_bytes(page, page.images[0])
+
+
+def icc_profile(n):
+    return b"<< /N %d /Length 0 >>\nstream\n\nendstream" % n
+
+
+def test_plain_rgb_jpeg_is_copied_verbatim():
+    jpeg = jpeg_bytes()
+    assert passthrough(photo_pdf(jpeg)) == jpeg
+    assert passthrough(photo_pdf(jpeg, decode="[0 1 0 1 0 1]")) == jpeg
+    assert passthrough(photo_pdf(jpeg, "[/ICCBased 7 0 R]", extra_objects=[icc_profile(3)])) == jpeg
+
+
+@pytest.mark.parametrize("colorspace, decode, extra", [
+    ("/DeviceCMYK", None, []),
+    ("[/ICCBased 7 0 R]", None, [icc_profile(4)]),
+    ("7 0 R", None, [b"[/ICCBased 8 0 R]", icc_profile(4)]),   # indirect colour space
+    ("/DeviceRGB", "[1 0 1 0 1 0]", []),                        # inverted
+])
+def test_cmyk_or_decoded_jpeg_is_rendered_instead(colorspace, decode, extra):
+    assert passthrough(photo_pdf(jpeg_bytes(), colorspace, decode, extra)) is None
+
+
+def test_cmyk_jpeg_behind_rgb_label_is_rendered_instead():
+    assert passthrough(photo_pdf(jpeg_bytes("CMYK"))) is None
+
+
+# ---------------------------------------------------------------------------
+# Page extraction
+# ---------------------------------------------------------------------------
+STUDENT_MAP = {"smith": [{"id": "S1", "roll": "7m", "first": "jo", "orig_last": "smith"}]}
+
+
+def scan(pdf_bytes, tmp_path):
+    with pdfplumber.open(BytesIO(pdf_bytes)) as pdf:
+        return extract_page(pdf.pages[0], 0, STUDENT_MAP, build_surname_trie(STUDENT_MAP),
+                            str(tmp_path))
+
+
+def test_claimed_photo_records_where_it_came_from(tmp_path):
+    pdf_bytes = photo_pdf(jpeg_bytes(), label="Smith")
+    page = scan(pdf_bytes, tmp_path)
+    assert page["results"] == {"S1": str(tmp_path / "p1_img0.jpg")}
+    assert page["placements"] == {"S1": {"img_index": 0, "bbox": [10.0, 50.0, 50.0, 100.0]}}
+    assert page["unmatched"] == []
+
+    # A later-page duplicate is reviewed as an orphan built from the
+    # placement; it can be cut again once its crop file has been pruned
+    source = tmp_path / "source.pdf"
+    source.write_bytes(pdf_bytes)
+    orphan = dict(page["placements"]["S1"], path=page["results"]["S1"], page=1, source=str(source))
+    os.remove(orphan["path"])
+    save_orphan_crop(orphan)
+    assert Image.open(orphan["path"]).size == (40, 50)
+
+
+def test_crop_names_do_not_depend_on_the_roster(tmp_path):
+    pdf_bytes = photo_pdf(jpeg_bytes(), label="Smith")
+    claimed = scan(pdf_bytes, tmp_path)["results"]["S1"]
+    before = os.stat(claimed).st_mtime_ns
+
+    # Another roster that doesn't know this student sees the same image as
+    # an orphan at the same path, and leaves the existing crop alone
+    with pdfplumber.open(BytesIO(pdf_bytes)) as pdf:
+        other = extract_page(pdf.pages[0], 0, {}, build_surname_trie({}), str(tmp_path))
+    assert other["unmatched"][0]["path"] == claimed
+    assert os.stat(claimed).st_mtime_ns == before
+    assert sorted(os.listdir(tmp_path)) == ["p1_img0.jpg"]  # no scratch files left behind
+
+
+def test_unclaimed_photo_becomes_orphan_without_a_crop(tmp_path):
+    page = scan(photo_pdf(jpeg_bytes(), label="Jones"), tmp_path)
+    assert page["results"] == {}
+    (orphan,) = page["unmatched"]
+    assert orphan["img_index"] == 0 and orphan["text_found"] == "Jones"
+    assert not os.path.exists(orphan["path"])
+
+
+def test_orphan_thumbnails_and_crops_read_the_scanned_source(tmp_path):
+    red, blue = Image.new("RGB", (40, 50), (220, 0, 0)), Image.new("RGB", (40, 50), (0, 0, 220))
+    scanned = tmp_path / "source.pdf"
+    scanned.write_bytes(photo_pdf(jpeg_of(red), label="Jones"))
+    orphan = dict(scan(scanned.read_bytes(), tmp_path)["unmatched"][0], source=str(scanned))
+
+    # A later upload to the shared path (same template, different face) must not leak in
+    (tmp_path / "photos.pdf").write_bytes(photo_pdf(jpeg_of(blue), label="Jones"))
+
+    thumb = Image.open(BytesIO(orphan_thumbnails([orphan])[orphan["path"]]))
+    assert thumb.convert("RGB").getpixel((5, 5))[0] > 150
+    save_orphan_crop(orphan)
+    assert Image.open(orphan["path"]).convert("RGB").getpixel((5, 5))[0] > 150
+
+
+# ---------------------------------------------------------------------------
+# Photo grid model
+# ---------------------------------------------------------------------------
+def box(x0, top, w=60, h=80):
+    return {"x0": x0, "x1": x0 + w, "top": top, "bottom": top + h}
+
+
+# 2 rows × 3 columns of portraits, labels printed in the 40 pt gap below each
+GRID_IMAGES = [box(x, y) for y in (20, 140) for x in (20, 110, 200)]
+
+
+def test_infer_photo_grid_finds_rows_and_columns():
+    grid = infer_photo_grid(GRID_IMAGES)
+    assert len(grid["row_tops"]) == 2 and len(grid["col_x0"]) == 3
+    assert grid["cells"] == {(r, c): r * 3 + c for r in range(2) for c in range(3)}
+
+
+def test_grid_ignores_a_logo_of_a_different_size():
+    grid = infer_photo_grid(GRID_IMAGES + [box(20, 400, w=200, h=30)])
+    assert len(grid["cells"]) == 6
+
+
+def test_two_portraits_in_one_cell_is_not_a_grid():
+    assert infer_photo_grid([box(20, 20), box(25, 22)]) is None
+    assert infer_photo_grid([box(20, 20)]) is None
+
+
+@pytest.mark.parametrize("label_top, label_cx, expected", [
+    (105, 50, 0),     # under the first portrait
+    (105, 230, 2),    # under the third
+    (225, 140, 4),    # second row, middle column
+    (10, 50, None),   # above the grid
+    (400, 50, None),  # far below the last row
+    (105, 500, None), # right of every column
+])
+def test_grid_cell_above(label_top, label_cx, expected):
+    assert grid_cell_above(infer_photo_grid(GRID_IMAGES), label_top, label_cx) == expected
+
+
+# ---------------------------------------------------------------------------
+# Word grid and roster fingerprint
+# ---------------------------------------------------------------------------
+def test_words_near_returns_a_superset_of_words_in_the_box():
+    words = [{"text": t, "x0": x, "x1": x + 30, "top": top, "bottom": top + 10}
+             for t, x, top in [("a", 10, 10), ("b", 200, 10), ("c", 15, 300), ("d", 60, 20)]]
+    grid = build_word_grid(build_word_table(words))
+    near = words_near(grid, 0, 30, 0, 80)
+    assert {0, 3} <= set(near) and 2 not in near
+    assert near == sorted(near)
+
+
+def test_fingerprint_only_changes_with_surnames_on_the_page():
+    word_keys = ["smith", "jo", "7m"]
+    before = {"smith": [{"id": "S1", "first": "jo", "roll": "7m"}],
+              "jones": [{"id": "S2", "first": "al", "roll": "7b"}]}
+    unrelated_edit = dict(before, jones=[{"id": "S2", "first": "alex", "roll": "7b"}])
+    relevant_edit = dict(before, smith=before["smith"] + [{"id": "S3", "first": "kim", "roll": "8r"}])
+
+    def fingerprint(student_map):
+        return page_roster_fingerprint(word_keys, student_map, build_surname_trie(student_map))
+
+    assert fingerprint(before) == fingerprint(unrelated_edit)
+    assert fingerprint(before) != fingerprint(relevant_edit)
+
+
+def test_orphans_whose_source_is_gone_fail_softly(tmp_path):
+    scanned = tmp_path / "source.pdf"
+    scanned.write_bytes(photo_pdf(jpeg_bytes(), label="Jones"))
+    orphan = dict(scan(scanned.read_bytes(), tmp_path)["unmatched"][0], source=str(scanned))
+    scanned.unlink()  # pruned from the photo cache
+
+    assert orphan_thumbnails([orphan]) == {orphan["path"]: None}
+    assert save_orphan_crop(orphan) is None
+    assert not os.path.exists(orphan["path"])